@@ -22,10 +22,135 @@ Created on February 6, 2012
 
 import struct          
 import os
+import bisect
+import mmap
 import sqlite3
+from cStringIO import StringIO
 from collections import OrderedDict
 from jabia_file import JABIA_file
 
+CTX_INDEX_SIGNATURE = "JABIACTX"
+CTX_INDEX_VERSION = 1
+CTX_INDEX_EXTENSION = ".idx"
+CTX_SQL_FETCH_SIZE = 4096
+# full-text index of the String table and the triggers that keep it in sync, the first module this sqlite build has is used
+CTX_SQL_FTS = [("CREATE VIRTUAL TABLE String_fts USING fts5(text, content='String', content_rowid='rowid')",
+                ["CREATE TRIGGER String_fts_insert AFTER INSERT ON String "
+                 "BEGIN INSERT INTO String_fts(rowid, text) VALUES(NEW.rowid, NEW.text); END",
+                 "CREATE TRIGGER String_fts_update AFTER UPDATE ON String "
+                 "BEGIN INSERT INTO String_fts(String_fts, rowid, text) VALUES('delete', OLD.rowid, OLD.text); "
+                 "INSERT INTO String_fts(rowid, text) VALUES(NEW.rowid, NEW.text); END",
+                 "CREATE TRIGGER String_fts_delete AFTER DELETE ON String "
+                 "BEGIN INSERT INTO String_fts(String_fts, rowid, text) VALUES('delete', OLD.rowid, OLD.text); END"]),
+               ("CREATE VIRTUAL TABLE String_fts USING fts4(content='String', text, tokenize=unicode61)",
+                # fts4 reads the old text from the String table, so it is removed from the index before it changes
+                ["CREATE TRIGGER String_fts_insert AFTER INSERT ON String "
+                 "BEGIN INSERT INTO String_fts(docid, text) VALUES(NEW.rowid, NEW.text); END",
+                 "CREATE TRIGGER String_fts_update_old BEFORE UPDATE ON String "
+                 "BEGIN DELETE FROM String_fts WHERE docid = OLD.rowid; END",
+                 "CREATE TRIGGER String_fts_update AFTER UPDATE ON String "
+                 "BEGIN INSERT INTO String_fts(docid, text) VALUES(NEW.rowid, NEW.text); END",
+                 "CREATE TRIGGER String_fts_delete BEFORE DELETE ON String "
+                 "BEGIN DELETE FROM String_fts WHERE docid = OLD.rowid; END"])]
+
+# edits of a language table are copied into the String table, and from there into its full-text index
+CTX_SQL_STRING_TRIGGERS = ["CREATE TRIGGER IF NOT EXISTS %(lang)s_string_insert AFTER INSERT ON %(lang)s "
+                           "BEGIN INSERT INTO String VALUES('%(lang)s', NEW.string_id, NEW.string); END",
+                           "CREATE TRIGGER IF NOT EXISTS %(lang)s_string_update AFTER UPDATE ON %(lang)s "
+                           "BEGIN UPDATE String SET string_id = NEW.string_id, text = NEW.string "
+                           "WHERE lang = '%(lang)s' AND string_id = OLD.string_id; END",
+                           "CREATE TRIGGER IF NOT EXISTS %(lang)s_string_delete AFTER DELETE ON %(lang)s "
+                           "BEGIN DELETE FROM String WHERE lang = '%(lang)s' AND string_id = OLD.string_id; END"]
+
+# every edit of a language table is logged, a NULL id means the order of the strings may have changed
+# and the whole language is read again, new rows always come last so inserts are logged by id
+CTX_SQL_TRIGGERS = ["CREATE TRIGGER IF NOT EXISTS %(lang)s_insert AFTER INSERT ON %(lang)s "
+                    "BEGIN INSERT INTO Change VALUES('%(lang)s', NEW.string_id); END",
+                    "CREATE TRIGGER IF NOT EXISTS %(lang)s_update AFTER UPDATE OF string ON %(lang)s "
+                    "BEGIN INSERT INTO Change VALUES('%(lang)s', NEW.string_id); END",
+                    "CREATE TRIGGER IF NOT EXISTS %(lang)s_update_id AFTER UPDATE OF string_id ON %(lang)s "
+                    "BEGIN INSERT INTO Change VALUES('%(lang)s', NULL); END",
+                    "CREATE TRIGGER IF NOT EXISTS %(lang)s_delete AFTER DELETE ON %(lang)s "
+                    "BEGIN INSERT INTO Change VALUES('%(lang)s', NULL); END"]
+
+def get_sql_languages(cur):
+    """ Returns the names of the language tables, in the order the languages are stored. """
+    rows = cur.execute("SELECT name FROM sqlite_master WHERE type = \"table\" AND name NOT IN (\"Meta\", \"Build\", \"Change\") "
+                       "AND name NOT LIKE \"String%\" ORDER BY rowid").fetchall()
+    return [row[0] for row in rows]
+
+def load_sql_language(cur, description):
+    language = CTX_language(description.encode('ascii','ignore')) # convert unicode to ascii
+    cur.execute("select string_id, string from %s order by rowid"  % description)
+    while True:
+        rows = cur.fetchmany(CTX_SQL_FETCH_SIZE)
+        
+        if len(rows) == 0:
+            break
+        for row in rows:                
+            language.add_data(row[0], row[1])
+    return language
+
+def track_sql_changes(cur, descriptions, ctx_filepath):
+    """ Log the edits of the language tables from now on, the database matches ctx_filepath at this point. """
+    cur.execute("CREATE TABLE IF NOT EXISTS Change(lang TEXT, string_id INT)")
+    cur.execute("CREATE TABLE IF NOT EXISTS Build(filepath TEXT, size INT, mtime REAL)")
+    for description in descriptions:
+        for trigger in CTX_SQL_TRIGGERS:
+            cur.execute(trigger % {"lang" : description})
+    stat = os.stat(ctx_filepath)
+    cur.execute("DELETE FROM Change")
+    cur.execute("DELETE FROM Build")
+    cur.execute("INSERT INTO Build VALUES(?, ?, ?)", (os.path.abspath(ctx_filepath), stat.st_size, stat.st_mtime))
+
+def get_sql_build(cur):
+    """ Returns the path of the ctx file the database matched when it was last built, None if it is unknown or changed since. """
+    tables = [row[0] for row in cur.execute("SELECT name FROM sqlite_master WHERE type = \"table\"")]
+    if "Build" not in tables or "Change" not in tables:
+        return None
+    row = cur.execute("SELECT filepath, size, mtime FROM Build").fetchone()
+    if row is None or not os.path.exists(row[0]):
+        return None
+    stat = os.stat(row[0])
+    if stat.st_size != row[1] or stat.st_mtime != row[2]:
+        return None
+    return row[0]
+
+def has_sql_triggers(cur, descriptions):
+    """ True if every language table still has all the triggers that log its edits. """
+    triggers = set((row[0], row[1]) for row in cur.execute("SELECT tbl_name, name FROM sqlite_master WHERE type = \"trigger\""))
+    for description in descriptions:
+        for trigger in CTX_SQL_TRIGGERS:
+            name = trigger.split()[5] % {"lang" : description}
+            if (description, name) not in triggers:
+                return False
+    return True
+
+def search_sql(sql_file, text):
+    """ Returns (language, string id, string) of every string that contains text.
+    
+    The full-text index is used if the database has one, text is then a full-text query
+    such as "officer key". Otherwise the strings are scanned for text.
+    """
+    con = sqlite3.connect(os.path.abspath(sql_file))
+    try:
+        cur = con.cursor()
+        tables = [row[0] for row in cur.execute("SELECT name FROM sqlite_master WHERE type = \"table\"")]
+        if "String_fts" in tables:
+            return cur.execute("SELECT lang, string_id, text FROM String WHERE rowid IN "
+                               "(SELECT rowid FROM String_fts WHERE String_fts MATCH ?) ORDER BY lang, string_id", 
+                               (text,)).fetchall()
+        if "String" in tables:
+            return cur.execute("SELECT lang, string_id, text FROM String WHERE text LIKE ? ORDER BY lang, string_id", 
+                               ("%" + text + "%",)).fetchall()
+        rows = []
+        for description in get_sql_languages(cur):
+            rows.extend(cur.execute("SELECT ?, string_id, string FROM %s WHERE string LIKE ? ORDER BY string_id" % description, 
+                                    (description, "%" + text + "%")).fetchall())
+        return rows
+    finally:
+        con.close()
+
 class CTX_ID:
     def __init__(self, id, id_name, path):
         self.id = id
@@ -45,25 +170,83 @@ class CTX_ID:
         return "CTX ID: %s, %s = %s" % (self.id, self.id_name, self.path)
  
          
+CTX_RECORD = struct.Struct("<II")     # string id, string length in characters
+
 class CTX_language:
+    """ Strings of one language.
+    
+    Strings read from a file are kept as the raw block of the file. The records of the block
+    are only indexed when the language is first used and the strings are only decoded
+    to unicode on first access, data_dictionary holds the record offset in raw_data until then.
+    """
+    raw_data = None
+    raw_block = None    # (start, end, number of items, last item id) of a block that is not indexed yet
+    
     def __init__(self, description_string, data_offset=0):
         self.description_string = description_string
         self.data_offset = data_offset
         self.data_dictionary = OrderedDict()   # {text id : data} mapping
     
     def add_data(self, id, text):
+        self.index_raw_block()
         self.data_dictionary[id] = text
     
+    def add_raw_block(self, raw_data, start, end, num_items, last_item_id):
+        """ Keep the block raw_data[start:end] of num_items records, it is indexed on first use. """
+        self.raw_data = raw_data
+        self.raw_block = (start, end, num_items, last_item_id)
+    
+    def index_raw_block(self):
+        if self.raw_block is not None:
+            start, end, num_items, last_item_id = self.raw_block
+            self.raw_block = None
+            self.add_raw_data(self.raw_data, start, num_items)
+    
+    def add_raw_data(self, raw_data, position, num_items):
+        """ Index num_items records of raw_data starting at position, returns the position after the last one. """
+        unpack_from = CTX_RECORD.unpack_from
+        record_size = CTX_RECORD.size
+        data_dictionary = self.data_dictionary
+        for i in xrange(0, num_items):
+            id, item_length = unpack_from(raw_data, position)
+            data_dictionary[id] = position
+            position += record_size + 2 * item_length   # utf-16, two bytes per character
+        self.raw_data = raw_data
+        return position
+    
+    def decode(self, position):
+        item_length = 2 * CTX_RECORD.unpack_from(self.raw_data, position)[1]
+        start = position + CTX_RECORD.size
+        return unicode(buffer(self.raw_data, start, item_length), "utf-16le")
+    
+    def get_string(self, id):
+        self.index_raw_block()
+        value = self.data_dictionary[id]
+        if isinstance(value, int):
+            value = self.decode(value)
+            self.data_dictionary[id] = value
+        return value
+    
     def get_description(self):
         return self.description_string
     
     def get_data(self):
+        self.index_raw_block()
+        if self.raw_data is not None:
+            for key, value in self.data_dictionary.iteritems():
+                if isinstance(value, int):
+                    self.data_dictionary[key] = self.decode(value)
+            self.raw_data = None
         return self.data_dictionary
     
     def get_num_items(self):
+        if self.raw_block is not None:
+            return self.raw_block[2]
         return len(self.data_dictionary)
     
     def get_last_item_id(self):
+        if self.raw_block is not None:
+            return self.raw_block[3]
         last_item = self.data_dictionary.popitem()  # get last item in ordered dictionary        
         # put item back
         self.add_data(last_item[0], last_item[1])
@@ -73,20 +256,51 @@ class CTX_language:
     def get_description_length(self):
         return len(self.description_string)
     
-    def get_packed_data(self):        
-        data_buffer = ""
-        for key, value in self.data_dictionary.items():       
+    def write_to(self, stream):
+        """ Write the string records to stream, returns the number of bytes written. """
+        if self.raw_block is not None:
+            # not used since it was read, the block is copied in one go
+            start, end = self.raw_block[:2]
+            stream.write(buffer(self.raw_data, start, end - start))
+            return end - start
+        length = 0
+        run_start = run_end = 0     # records that were never decoded are copied as they are, a run at a time
+        for key, value in self.data_dictionary.iteritems():       
+            if isinstance(value, int):
+                if value != run_end:
+                    if run_end > run_start:
+                        stream.write(buffer(self.raw_data, run_start, run_end - run_start))
+                    run_start = value
+                run_end = value + CTX_RECORD.size + 2 * CTX_RECORD.unpack_from(self.raw_data, value)[1]
+                length += run_end - value
+                continue
             encoded_value = value.encode('utf-16le')     
             encoded_size = len(encoded_value)         
-            data_packed = struct.pack("<II%is" % encoded_size, key, encoded_size/2, encoded_value)
-            #print binascii.hexlify(data_packed)
-            data_buffer = data_buffer + data_packed
-            #print binascii.hexlify(data_buffer)
-        return data_buffer
+            if run_end > run_start:
+                stream.write(buffer(self.raw_data, run_start, run_end - run_start))
+            run_start = run_end = 0
+            stream.write(CTX_RECORD.pack(key, encoded_size/2) + encoded_value)
+            length += CTX_RECORD.size + encoded_size
+        if run_end > run_start:
+            stream.write(buffer(self.raw_data, run_start, run_end - run_start))
+        return length
+    
+    def get_packed_data(self):        
+        stream = StringIO()
+        self.write_to(stream)
+        return stream.getvalue()
+    
+    def __getstate__(self):
+        # yaml dumps hold the decoded strings only
+        self.get_data()
+        state = self.__dict__.copy()
+        state.pop("raw_data", None)
+        state.pop("raw_block", None)
+        return state
     
     def __repr__(self):
         return "%s(name=%r, language=%r, data=%r)" % (
-             self.__class__.__name__, self.description_string, self.data_dictionary)
+             self.__class__.__name__, self.description_string, self.get_data())
    
     def __str__(self):
         return "Language: %s, data offset: %s bytes" % (self.description_string, hex(self.data_offset).rstrip('L'))
@@ -111,7 +325,8 @@ class CTX_data:
     def insert_language(self, language):
         self.language_list.append(language)
     
-    def unpack(self, file_pointer, peek=False, verbose=False):    
+    def unpack_header(self, file_pointer):
+        """ Read the item counts and the language table, the file is left at the start of the string data. """
         self.num_items,self.last_item_id,self.num_languages = struct.unpack("<III", file_pointer.read(12))
         
         for i in range(0, self.num_languages):
@@ -122,6 +337,9 @@ class CTX_data:
         
         self.data_offset = file_pointer.tell()
         
+    def unpack(self, file_pointer, peek=False, verbose=False):    
+        self.unpack_header(file_pointer)
+        
         if peek or verbose:
             print "Number of items: %s" % self.num_items
             print "Last item id: %i" % self.last_item_id
@@ -132,16 +350,15 @@ class CTX_data:
         if peek:
             return 
         
+        # every language block is read in one go, strings are decoded when they are used
+        raw_data = file_pointer.read()
+        block_starts = sorted(set(language.data_offset for language in self.language_list)) + [len(raw_data)]
         for language in self.language_list:
-            file_pointer.seek(self.data_offset + language.data_offset)
-            for i in range(0, self.num_items):
-                id,item_length = struct.unpack("<II", file_pointer.read(8))
-                item_length = 2 * item_length               # multiply by two to compensate for the "\0"
-                item_raw_text = file_pointer.read(item_length)                
-                item_text = unicode(item_raw_text, "utf-16le")                
-                language.add_data(id, item_text)
-                if verbose:
-                    print id,item_text    
+            end = block_starts[bisect.bisect_right(block_starts, language.data_offset)]
+            language.add_raw_block(raw_data, language.data_offset, end, self.num_items, self.last_item_id)
+            if verbose:
+                for id in language.get_data():
+                    print id,language.get_string(id)
     
     def language_list_check(self):
         for i in range(1, len(self.language_list)):
@@ -150,7 +367,12 @@ class CTX_data:
             if self.language_list[i].get_last_item_id()  != self.last_item_id:
                 raise  Exception("The last item in each language does not contain the same id!")
             
-    def get_packed_data(self):
+    def write_to(self, stream):
+        """ Write the ctx file to a seekable stream.
+        
+        The language table is written with zero offsets first, the offset of each language
+        is only known once the languages before it are written and is patched in at the end.
+        """
         #1. check to see if all the language have the same amount of items
         #2. check that all languages have the same last item id
         self.num_languages = self.get_num_languages()
@@ -158,94 +380,298 @@ class CTX_data:
         self.last_item_id = self.language_list[0].get_last_item_id()        
         
         self.language_list_check()
-#        for i in range(1, len(self.language_list)):
-#            if self.language_list[i].get_num_items() != self.num_items:
-#                raise  Exception("Languages do not contain same amount of items!")
-#            if self.language_list[i].get_last_item_id()  != self.last_item_id:
-#                raise  Exception("The last item in each language does not contain the same id!")
             
-        #3. pack each language into a byte string and create the data 
-        header_buffer = struct.pack("<III", self.num_items, self.last_item_id, self.num_languages)
-        data_buffer = ""
-        previous_buffer_length = 0
+        #3. write the header and the language table 
+        stream.write(struct.pack("<III", self.num_items, self.last_item_id, self.num_languages))
+        offset_positions = []
         for language in self.language_list:
             length = language.get_description_length()
             description = language.get_description()
-            header_buffer = header_buffer + struct.pack("<I%isI" % length, length, description, previous_buffer_length)
-            #print binascii.hexlify(header_buffer)
-            data_buffer = data_buffer + language.get_packed_data()
-            previous_buffer_length = len(data_buffer)
-            
-        #4. concatenate the byte strings and return     
-        return (header_buffer + data_buffer)            
+            stream.write(struct.pack("<I%is" % length, length, description))
+            offset_positions.append(stream.tell())
+            stream.write(struct.pack("<I", 0))
+        
+        #4. stream each language and backpatch its offset
+        data_offsets = []
+        data_length = 0
+        for language in self.language_list:
+            data_offsets.append(data_length)
+            data_length += language.write_to(stream)
+        end = stream.tell()
+        for position, data_offset in zip(offset_positions, data_offsets):
+            stream.seek(position)
+            stream.write(struct.pack("<I", data_offset))
+        stream.seek(end)
+    
+    def get_packed_data(self):
+        stream = StringIO()
+        self.write_to(stream)
+        return stream.getvalue()
 
     def __repr__(self):
         return "%s(name=%r, languages=%r)" % (
              self.__class__.__name__, self.language_list)
             
+class CTX_index:
+    """ {string id : record offset} lookup for every language of a ctx file.
+    
+    It is built from the language table and the record headers alone, the strings themselves
+    are not read. A single string is then read and decoded with one seek.
+    """
+    sidecar_header = struct.Struct("<8sIQdIII")
+    
+    def __init__(self):
+        self.description_list = []
+        self.offsets = {}   # {language description : {string id : offset of the record in the file}} mapping
+        self.packed = {}    # {language description : packed (string id, offset) records} read from a sidecar
+        
+    def build(self, file_pointer):
+        ctx_data = CTX_data()
+        ctx_data.unpack_header(file_pointer)
+        # only the pages holding record headers are read through the map
+        file_map = mmap.mmap(file_pointer.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for language in ctx_data.get_languages():
+                position = ctx_data.data_offset + language.data_offset
+                offsets = {}
+                for i in xrange(0, ctx_data.num_items):
+                    id, item_length = CTX_RECORD.unpack_from(file_map, position)
+                    offsets[id] = position
+                    position += CTX_RECORD.size + 2 * item_length
+                self.description_list.append(language.get_description())
+                self.offsets[language.get_description()] = offsets
+        finally:
+            file_map.close()
+        return self
+    
+    def save(self, sidecar_path, ctx_size, ctx_mtime):
+        descriptions = "\00".join(self.description_list)
+        num_items = len(self.get_offsets(self.description_list[0])) if len(self.description_list) > 0 else 0
+        with open(sidecar_path, "wb") as f:
+            f.write(self.sidecar_header.pack(CTX_INDEX_SIGNATURE, CTX_INDEX_VERSION, ctx_size, ctx_mtime,
+                                             len(self.description_list), num_items, len(descriptions)))
+            f.write(descriptions)
+            for description in self.description_list:
+                offsets = self.get_offsets(description)
+                f.write(struct.pack("<%iI" % (2 * len(offsets)), *[value for item in offsets.iteritems() for value in item]))
+    
+    def load(self, sidecar_path, ctx_size, ctx_mtime):
+        """ Load a sidecar, returns False if it is missing or does not match the ctx file. """
+        if not os.path.exists(sidecar_path):
+            return False
+        with open(sidecar_path, "rb") as f:
+            data = f.read()
+        if len(data) < self.sidecar_header.size:
+            return False
+        signature, version, size, mtime, num_languages, num_items, descriptions_length = \
+            self.sidecar_header.unpack_from(data, 0)
+        if signature != CTX_INDEX_SIGNATURE or version != CTX_INDEX_VERSION or \
+            size != ctx_size or mtime != ctx_mtime:
+            return False
+        position = self.sidecar_header.size
+        self.description_list = data[position:position + descriptions_length].split("\00") if num_languages > 0 else []
+        position += descriptions_length
+        # the lookup of a language is only built when it is first used
+        records_length = 2 * num_items * 4
+        for description in self.description_list:
+            self.packed[description] = data[position:position + records_length]
+            position += records_length
+        return True
+    
+    def get_offsets(self, description):
+        if description not in self.offsets:
+            if description not in self.packed:
+                raise KeyError("Language %s is not in file" % description)
+            packed = self.packed.pop(description)
+            values = struct.unpack("<%iI" % (len(packed) / 4), packed)
+            self.offsets[description] = dict(zip(values[0::2], values[1::2]))
+        return self.offsets[description]
+    
+    def read_string(self, file_pointer, description, id):
+        """ Read and decode one string, raises KeyError for an unknown language or id. """
+        offsets = self.get_offsets(description)
+        if id not in offsets:
+            raise KeyError("String %i is not in language %s" % (id, description))
+        file_pointer.seek(offsets[id])
+        id, item_length = CTX_RECORD.unpack(file_pointer.read(CTX_RECORD.size))
+        return unicode(file_pointer.read(2 * item_length), "utf-16le")
+    
+    def __str__(self):
+        return "Languages: %s, number of strings: %i" % (", ".join(self.description_list), 
+                                                         sum(len(self.get_offsets(description)) for description in self.description_list))
+
 class CTX_file(JABIA_file):    
     def __init__(self, filepath=None):
         super(CTX_file,self).__init__(filepath=filepath)
         self.yaml_extension = ".ctx.txt"
+        self.index = None
         
     def open(self, filepath=None, peek=False):
         super(CTX_file,self).open(filepath=filepath, peek=peek)  
         self.data = CTX_data()
         
-    def dump2sql(self, dest_filepath=os.getcwd()):         
+    def pack(self, verbose=False):
+        super(CTX_file,self).pack(verbose=verbose)
+        # the offsets of the old file are stale now
+        self.index = None
+        
+    def get_sidecar_path(self):
+        return self.filepath + CTX_INDEX_EXTENSION
+    
+    def get_index(self, sidecar=None):
+        """ Return the string lookup of the file, without unpacking it.
+        
+        If sidecar is True the index is cached next to the ctx file, if it is a path it is cached there.
+        A cached index is only used while the file size and modification time match. 
+        """
+        if self.index is not None:
+            return self.index
+        index = CTX_index()
+        if sidecar:
+            if sidecar is True:
+                sidecar = self.get_sidecar_path()
+            stat = os.stat(self.filepath)
+            if not index.load(sidecar, stat.st_size, stat.st_mtime):
+                with open(self.filepath, "rb") as f:
+                    index.build(f)
+                index.save(sidecar, stat.st_size, stat.st_mtime)
+        else:
+            with open(self.filepath, "rb") as f:
+                index.build(f)
+        self.index = index
+        return self.index
+    
+    def get_string(self, description, id, sidecar=None):
+        """ Return one string of one language, e.g. get_string("eng", 12). """
+        index = self.get_index(sidecar)
+        with open(self.filepath, "rb") as f:
+            return index.read_string(f, description, id)
+        
+    def dump2sql(self, dest_filepath=os.getcwd(), normalized=False):         
+        """ Export the strings to a sqlite database, one table per language.
+        
+        If normalized is True a single String(lang, string_id, text) table with a full-text
+        index is added for searching, triggers keep both in line with edits of the language tables.
+        Only the language tables are read back by sql2bin.
+        """
         file_name = os.path.join(dest_filepath, os.path.splitext(os.path.basename(self.filepath))[0])        
         self.sqlite_extension = ".sqlite"
         full_path = file_name + self.sqlite_extension 
         print "Creating %s" % full_path
-        con = sqlite3.connect(full_path)
-        with con:
-            cur = con.cursor()
+        # the database is generated from the ctx file, so it does not need to survive a crash half way 
+        con = sqlite3.connect(full_path, isolation_level=None)
+        con.execute("PRAGMA synchronous = OFF")
+        con.execute("PRAGMA journal_mode = MEMORY")
+        cur = con.cursor()
+        # sqlite3 commits before every CREATE and DROP by itself, the transaction is managed here
+        cur.execute("BEGIN")
+        try:
             cur.execute("DROP TABLE IF EXISTS Meta") 
             cur.execute("CREATE TABLE Meta(number_languages INT, number_items INT, laste_item_id INT)")
             cur.execute("INSERT INTO Meta VALUES(?, ?, ?)", (self.data.get_num_languages(), self.data.get_num_items(), self.data.language_list[0].get_last_item_id()) )              
     
             self.data.language_list_check()
             for language in self.data.language_list:
-                cur.execute("DROP TABLE IF EXISTS %s" % language.get_description())
-                table_schema = "CREATE TABLE %s(string_id INT, string TEXT);" % language.get_description()
-                cur.execute(table_schema)
-                data = language.get_data()
-                for key, value in data.items():                    
-                    cur.execute("INSERT INTO %s VALUES(?, ?)" % language.get_description(), (key, value))
+                description = language.get_description()
+                cur.execute("DROP TABLE IF EXISTS %s" % description)
+                cur.execute("CREATE TABLE %s(string_id INT, string TEXT)" % description)
+                cur.executemany("INSERT INTO %s VALUES(?, ?)" % description, language.get_data().iteritems())
+                cur.execute("CREATE INDEX %s_string_id ON %s(string_id)" % (description, description))
+            track_sql_changes(cur, [language.get_description() for language in self.data.language_list], self.filepath)
+            
+            cur.execute("DROP TABLE IF EXISTS String_fts")
+            cur.execute("DROP TABLE IF EXISTS String")
+            if normalized:
+                cur.execute("CREATE TABLE String(lang TEXT, string_id INT, text TEXT)")
+                for language in self.data.language_list:
+                    description = language.get_description()
+                    cur.executemany("INSERT INTO String VALUES(?, ?, ?)", 
+                                    ((description, key, value) for key, value in language.get_data().iteritems()))
+                cur.execute("CREATE INDEX String_lang ON String(lang, string_id)")
+                for fts_schema, fts_triggers in CTX_SQL_FTS:
+                    try:
+                        cur.execute(fts_schema)
+                    except sqlite3.OperationalError:
+                        # no such module, strings are then searched with LIKE
+                        continue
+                    cur.execute("INSERT INTO String_fts(String_fts) VALUES('rebuild')")
+                    for trigger in fts_triggers:
+                        cur.execute(trigger)
+                    break
+                for language in self.data.language_list:
+                    for trigger in CTX_SQL_STRING_TRIGGERS:
+                        cur.execute(trigger % {"lang" : language.get_description()})
+            cur.execute("COMMIT")
+        except:
+            cur.execute("ROLLBACK")
+            raise
+        finally:
+            con.close()
 
-                
-    def sql2bin(self, sql_file):
+    def patch_from_sql(self, cur, descriptions, verbose=False):
+        """ Load the ctx file the database was last built from and apply the logged edits to it.
+        
+        Returns False if that file is gone or changed, if languages were added or removed, or if
+        the edits may not all be logged: a language table lost a trigger, or its number of rows
+        does not match the patched language, e.g. after it was dropped and created again.
+        Strings that were not edited stay undecoded and are copied as they are when packing.
+        """
+        base_filepath = get_sql_build(cur)
+        if base_filepath is None or not has_sql_triggers(cur, descriptions):
+            return False
+        base_data = CTX_data()
+        with open(base_filepath, "rb") as f:
+            base_data.unpack(f)
+        languages = OrderedDict((language.get_description(), language) for language in base_data.get_languages())
+        if languages.keys() != [description.encode('ascii','ignore') for description in descriptions]:
+            return False
+        
+        changes = cur.execute("SELECT lang, string_id FROM Change GROUP BY lang, string_id ORDER BY min(rowid)").fetchall()
+        reload = set(description for description, id in changes if id is None)
+        for description in reload:
+            languages[description.encode('ascii','ignore')] = load_sql_language(cur, description)
+        changes = [(description, id) for description, id in changes if description not in reload]
+        for description, id in changes:
+            language = languages[description.encode('ascii','ignore')]
+            # with duplicate ids the last row wins, as in a full build
+            row = cur.execute("SELECT string FROM %s WHERE string_id = ? ORDER BY rowid DESC LIMIT 1" % description, 
+                              (id,)).fetchone()
+            if row is not None:
+                language.add_data(id, row[0])
+        for description in descriptions:
+            count = cur.execute("SELECT count(*) FROM %s" % description).fetchone()[0]
+            if count != languages[description.encode('ascii','ignore')].get_num_items():
+                return False
+        if verbose:
+            print "Patching %i strings of %s, %i languages reloaded" % (len(changes), base_filepath, len(reload))
+        self.data = CTX_data()
+        for language in languages.itervalues():
+            self.data.insert_language(language)
+        return True
+    
+    def sql2bin(self, sql_file, incremental=True, verbose=False):
+        """ Pack the language tables of a database into the ctx file.
+        
+        If the database logs its edits and the ctx file it was last built from is unchanged,
+        only the edited strings are encoded, see patch_from_sql.
+        """
         full_path = os.path.abspath(sql_file)
         con = sqlite3.connect(full_path)
         
         # Meta table is not used to fill CTX_Data, it is solely for user convenience 
         with con:
             cur = con.cursor()             
-            tables = cur.execute("SELECT name FROM sqlite_master WHERE type = \"table\" AND name != \"Meta\"").fetchall()
+            tables = get_sql_languages(cur)
             self.data.num_languages = len(tables) 
             if self.data.num_languages > 0:
-#                print self.data.num_languages
-                self.data.num_items = cur.execute("select count(*) from eng").fetchone()[0]
-#                print self.data.num_items
-                self.data.last_item_id = cur.execute("select max(string_id) from eng").fetchone()[0]
-#                print self.data.last_item_id
-                
-                for description in tables:
-                    language = CTX_language(description[0].encode('ascii','ignore')
-) # convert unicode to ascii
-                    cur.execute("select * from %s"  % description[0])
-                    while True:
-                        row = cur.fetchone()
-                        
-                        if row == None:
-                            break
-                        else:                
-                            language.add_data(row[0], row[1])
-                        
-                    self.data.insert_language(language)
+                if not incremental or not self.patch_from_sql(cur, tables, verbose):
+                    for description in tables:
+                        self.data.insert_language(load_sql_language(cur, description))
                 self.pack()
+                track_sql_changes(cur, tables, self.filepath)
             else:
                 raise Exception("Database is empty")
+        con.close()
                     
 if __name__ == "__main__":
     pass
@@ -22,7 +22,8 @@ Created on February 6, 2012
 
 import argparse
 import os
-from ctx_file import CTX_file
+import sys
+from ctx_file import CTX_file, search_sql
 
 parser = argparse.ArgumentParser(description='Tool that can unpack/pack Jagged Alliance: BiA compiled text (ctx) files.', \
                                 epilog='All languages must contain the same number of entries and the last ' + \
@@ -32,6 +33,14 @@ parser.add_argument('file', nargs='?', help='Input file')
 parser.add_argument('outdir', nargs='?', default=os.getcwd(), help='Output directory')
 parser.add_argument('-i', '--info', default=False, action='store_true', help='Output information about ctx file')
 parser.add_argument('-d', '--debug', default=False, action='store_true', help='Show debug messages.')
+parser.add_argument('-s', '--string', nargs=2, metavar=('LANGUAGE', 'ID'), help='Print one string of a ctx file without unpacking it')
+parser.add_argument('--sidecar', nargs='?', const=True, default=None, metavar='INDEX',
+                    help='Cache the string index in a sidecar index file, next to the ctx file by default')
+parser.add_argument('--fts', default=False, action='store_true', 
+                    help='Add a single table of the strings of every language with a full-text index to the sqlite database')
+parser.add_argument('--search', metavar='TEXT', help='Print the strings of a sqlite database that contain TEXT')
+parser.add_argument('--full', default=False, action='store_true', 
+                    help='Rebuild the whole ctx file from a sqlite database, instead of patching the strings edited since the last build')
 
 
 args = parser.parse_args()
@@ -40,7 +49,12 @@ outdir = args.outdir
 info = args.info
 debug = args.debug
 
-if file != None and os.path.splitext(file)[1][1:].strip() == "ctx":            
+if file != None and os.path.splitext(file)[1][1:].strip() == "ctx" and args.string != None:
+    ctx_file = CTX_file(filepath=os.path.abspath(file))
+    language, id = args.string
+    print ctx_file.get_string(language, int(id), args.sidecar).encode("utf-8")
+
+elif file != None and os.path.splitext(file)[1][1:].strip() == "ctx":            
     ctx_filepath = os.path.abspath(file)
     print "Unpacking %s" % ctx_filepath
     ctx_file = CTX_file(filepath=ctx_filepath)
@@ -50,7 +64,7 @@ if file != None and os.path.splitext(file)[1][1:].strip() == "ctx":
     if not info:
         output_filepath = os.path.abspath(outdir)
         ctx_file.dump2yaml(outdir)
-        ctx_file.dump2sql(outdir)
+        ctx_file.dump2sql(outdir, normalized=args.fts)
     
 elif file != None and os.path.splitext(file)[1][1:].strip() == "txt":            
     yaml_ctx_filepath = os.path.abspath(file)
@@ -61,6 +75,14 @@ elif file != None and os.path.splitext(file)[1][1:].strip() == "txt":
     ctx_file = CTX_file(filepath=ctx_filepath)
     ctx_file.yaml2bin(yaml_ctx_filepath)
 
+elif file != None and os.path.splitext(file)[1][1:].strip() == "sqlite" and args.search != None:
+    try:
+        text = args.search.decode("utf-8")
+    except UnicodeDecodeError:
+        text = args.search.decode(sys.getfilesystemencoding())
+    for language, id, text in search_sql(file, text):
+        print ("%s %i: %s" % (language, id, text)).encode("utf-8")
+
 elif file != None and os.path.splitext(file)[1][1:].strip() == "sqlite":            
     sql_ctx_filepath = os.path.abspath(file)
     ctx_file_name = os.path.basename(file).split('.')[0] + ".ctx"    
@@ -68,7 +90,7 @@ elif file != None and os.path.splitext(file)[1][1:].strip() == "sqlite":
         
     print "Packing %s" % sql_ctx_filepath
     ctx_file = CTX_file(filepath=ctx_filepath)
-    ctx_file.sql2bin(sql_ctx_filepath)
+    ctx_file.sql2bin(sql_ctx_filepath, incremental=not args.full, verbose=debug)
 
 else:
     print "Nothing happened"
@@ -22,6 +22,7 @@ Created on February 16, 2012
 
 import struct 
 import binascii           
+from cStringIO import StringIO
 from collections import OrderedDict
 from jabia_file import JABIA_file
 from jabia_object import JABIA_sound, JABIA_font
@@ -89,25 +90,28 @@ class CUI_ui_element:
         self.verteces = verteces    # list of CUI_ui_element_verteces
         self.trailer = trailer      # 
 
-    def get_packed_data(self):        
-        data_buffer = struct.pack("<II%isI" % (len(self.name)), 
-                                  self.element_id, len(self.name), self.name, self.unknown0)
-        data_buffer += struct.pack("<7Hx", *self.unknown1)
-        data_buffer += struct.pack("<H", len(self.verteces))
+    def write_to(self, stream):        
+        stream.write(struct.pack("<II%isI" % (len(self.name)), 
+                                 self.element_id, len(self.name), self.name, self.unknown0))
+        stream.write(struct.pack("<7Hx", *self.unknown1))
+        stream.write(struct.pack("<H", len(self.verteces)))
         
         for vertex in self.verteces:
-            data_buffer += vertex.get_packed_data()
+            stream.write(vertex.get_packed_data())
             
         if self.trailer == "magick1":
-            data_buffer += binascii.unhexlify(magick1)            
+            stream.write(binascii.unhexlify(magick1))
         elif self.trailer == "magick2":
-            data_buffer += binascii.unhexlify(magick2)
+            stream.write(binascii.unhexlify(magick2))
         elif self.trailer == "magick3":
-            data_buffer += struct.pack("Hxx", 0x0)
+            stream.write(struct.pack("Hxx", 0x0))
         else:
-            data_buffer += self.trailer.get_packed_data()
-#        print binascii.hexlify(data_buffer)
-        return data_buffer
+            stream.write(self.trailer.get_packed_data())
+    
+    def get_packed_data(self):        
+        stream = StringIO()
+        self.write_to(stream)
+        return stream.getvalue()
     
         
 #    def __repr__(self):
@@ -370,7 +374,7 @@ class CUI_data:
         # merc, uint32 layer, 0x0000, uint32 ui type 0x26 (Pic_Background_white(solid)), 0x01c5 resource id, uint32, uint32 length, name, byte column, byte row, int16 x offset from grid center, 
         # int16 y offset from grid center, nonsense
         
-    def get_packed_data(self):        
+    def write_to(self, stream):        
         last_ctx_id = self.ctx_id_list[-1].id     
         num_sounds = len(self.sound_list)
         num_binary = len(self.binary_blob_dictionary)
@@ -380,44 +384,47 @@ class CUI_data:
         num_ui_elements = len(self.ui_element_dict)
         
         # 1. compile ctx mappings
-        data_buffer = struct.pack("<II", last_ctx_id, 0xFFFFFFFF)      
+        stream.write(struct.pack("<II", last_ctx_id, 0xFFFFFFFF))
         for ctx_id in self.ctx_id_list:
-            data_buffer = data_buffer + ctx_id.get_packed_data()
+            stream.write(ctx_id.get_packed_data())
 
         # 2. compile sound mappings
-        data_buffer = data_buffer + struct.pack("<I", num_sounds)
+        stream.write(struct.pack("<I", num_sounds))
         for sound in self.sound_list:
-            data_buffer = data_buffer + sound.get_packed_data()
+            stream.write(sound.get_packed_data())
         
         # 3. compile unknown binary data
-        data_buffer = data_buffer + struct.pack("<I", num_binary)
+        stream.write(struct.pack("<I", num_binary))
         for key, value in self.binary_blob_dictionary.items():        
-            data_packed = struct.pack("<I%is" % len(value), key, value)
-            data_buffer = data_buffer + data_packed                
+            stream.write(struct.pack("<I%is" % len(value), key, value))
         
         # 4. compile fonts
-        data_buffer = data_buffer + struct.pack("<I", num_fonts)
+        stream.write(struct.pack("<I", num_fonts))
         for font in self.font_list:
-            data_buffer = data_buffer + font.get_packed_data()
+            stream.write(font.get_packed_data())
         
         # 5. compile ui resources
-        data_buffer = data_buffer + struct.pack("<I", num_ui_resources)
+        stream.write(struct.pack("<I", num_ui_resources))
         for key, value in self.ui_resource_dict.items():
-            data_buffer = data_buffer + value.get_packed_data()
+            stream.write(value.get_packed_data())
         
         # 6. compile ui icons
-        data_buffer = data_buffer + struct.pack("<I", num_ui_icons)
+        stream.write(struct.pack("<I", num_ui_icons))
         for key, value in self.ui_icon_dict.items():
-            data_buffer = data_buffer + value.get_packed_data()
+            stream.write(value.get_packed_data())
         
         # 7. compile ui elements
-        data_buffer = data_buffer + struct.pack("<I", num_ui_elements)
+        stream.write(struct.pack("<I", num_ui_elements))
         for key, value in self.ui_element_dict.items():
-            data_buffer = data_buffer + value.get_packed_data()
+            value.write_to(stream)
         
         # 8. compile ui screen binary blob
-        data_buffer = data_buffer + self.binary_ui_blob
-        return (data_buffer)  
+        stream.write(self.binary_ui_blob)
+    
+    def get_packed_data(self):        
+        stream = StringIO()
+        self.write_to(stream)
+        return stream.getvalue()
     
     def __repr__(self):
         return "%s(name=%r)" % (
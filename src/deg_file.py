@@ -25,6 +25,7 @@ import os
 import codecs
 import yaml
 import binascii           
+from cStringIO import StringIO
 from collections import OrderedDict
 from jabia_file import JABIA_file
 
@@ -104,23 +105,23 @@ class DEG_data:
             
 
                     
-    def get_packed_data(self):
-        #1. get number of entries
-        num_entries = self.get_num_entries()     
-        header_buffer = struct.pack("<I", num_entries)
+    def write_to(self, stream):
+        #1. write number of entries
+        stream.write(struct.pack("<I", self.get_num_entries()))
         
-        #2. pack each entry 
-        data_buffer = ""
+        #2. write each entry 
         for entry in self.entry_list:                                                   
-            data_buffer += struct.pack("<I", DEG_entry_start)
-            data_buffer += entry.get_packed_data()
+            stream.write(struct.pack("<I", DEG_entry_start))
+            stream.write(entry.get_packed_data())
             if entry.has_normals():
-                data_buffer += struct.pack("<B", 0x01)
+                stream.write(struct.pack("<B", 0x01))
             else:
-                data_buffer += struct.pack("<B", 0x00)
-            
-        #3. concatenate the header and data   
-        return (header_buffer + data_buffer)            
+                stream.write(struct.pack("<B", 0x00))
+    
+    def get_packed_data(self):
+        stream = StringIO()
+        self.write_to(stream)
+        return stream.getvalue()
 
     def __repr__(self):
         return "%s(name=%r, languages=%r)" % (
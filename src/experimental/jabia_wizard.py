@@ -45,7 +45,7 @@ class wizard_settings(object):
         self.yaml_extension = ".txt"
         yaml_file = self.filepath + self.yaml_extension
         self.file_list = ["data_win32.pak", "data1_win32.pak", "data2_win32.pak", 
-                          "data3_win32.pak", "data4_win32.pak", "data5_win32.pak", "data6_win32.pak"
+                          "data3_win32.pak", "data4_win32.pak", "data5_win32.pak", "data6_win32.pak",
                           "configs_win32.pak.crypt", "interface_win32.pak.crypt"]
         #self.file_list = ["data6_win32.pak"]
         if os.path.exists(os.path.join(os.getcwd(), yaml_file)):
@@ -205,6 +205,7 @@ class JABIA_Tools_wizard(object):
     
         pub.subscribe(self.dirChanged, "DIR_CHANGED")
         pub.subscribe(self.finish, "FINISH")
+        pub.subscribe(self.extractProgress, "EXTRACT_PROGRESS")
         
         self.page4 = wizard_page(self.mywiz, "Unpacking files")
         #vbox = wx.BoxSizer(wx.VERTICAL)
@@ -214,6 +215,8 @@ class JABIA_Tools_wizard(object):
         #vbox.Add(panel)
 #        self.status = wx.TextCtrl(panel, -1, '', size = wx.Size(200, 200), style=wx.TE_MULTILINE | wx.TE_READONLY | wx.TE_NO_VSCROLL)
         self.status = wx.TextCtrl(panel, -1, '', size = wx.Size(200, 200), style=wx.TE_MULTILINE | wx.TE_READONLY)
+        self.gauge = wx.Gauge(panel, -1, 100, size=(340, 25))
+        self.rate = wx.StaticText(panel, -1, '')
         #vbox.Add(self.status)
         #self.page4.add_stuff(vbox)
         
@@ -221,6 +224,8 @@ class JABIA_Tools_wizard(object):
         self.hsizer.Add(self.status, 10, wx.EXPAND)
         self.vsizer=wx.BoxSizer(wx.VERTICAL)
         self.vsizer.Add(self.hsizer, 1, wx.EXPAND)
+        self.vsizer.Add(self.gauge, 0, wx.EXPAND | wx.TOP, padding)
+        self.vsizer.Add(self.rate, 0, wx.EXPAND | wx.TOP, padding)
         panel.SetSizer(self.vsizer)
                 
         self.page4.add_stuff(panel)
@@ -253,6 +258,17 @@ class JABIA_Tools_wizard(object):
             pub.sendMessage("DIR_CHANGED", message=dlg.GetPath())
         dlg.Destroy()
         
+    def extractProgress(self, message):
+        """ Handler for "EXTRACT_PROGRESS" messages, message holds the numbers of one PROGRESS line of pak_magick. """
+        event, files_done, total_files, bytes_done, total_bytes, bytes_per_second, files_per_second, eta = message
+        if total_bytes > 0:
+            self.gauge.SetValue(int(bytes_done * 100 / total_bytes))
+        text = "%i/%i files, %.1f MB/s, %.0f files/s" % (files_done, total_files, bytes_per_second / (1024 * 1024), 
+                                                        files_per_second)
+        if event == "progress" and eta >= 0:
+            text += ", %i s left" % eta
+        self.rate.SetLabel(text)
+    
     def finish(self):
         if self.mywiz.GetCurrentPage() == self.mywiz.pages[2]:  
             self.mywiz.GetCurrentPage().SetNext(self.mywiz.pages[3])          
@@ -263,12 +279,35 @@ class JABIA_Tools_wizard(object):
         self.mywiz.FindWindowById(wx.ID_FORWARD).Disable()
         self.mywiz.FindWindowById(wx.ID_BACKWARD).Disable()
         self.mywiz.FindWindowById(wx.ID_CANCEL).Disable()   
-        for file in self.settings.file_list:
+        for i, file in enumerate(self.settings.file_list):
             pak_filepath = os.path.join(self.settings.jabia_path, file)                
-            cmd = "pak_magick.exe %s %s" % (pak_filepath, self.settings.workspace_path)
-            wx.CallAfter(self.status.AppendText, cmd + "\n\n")
+            # only files that changed since the last run are written again, files that a later
+            # pak file overrides are left to that pak file
+            cmd = ["pak_magick.exe", pak_filepath, self.settings.workspace_path, "--update"]
+            later = [os.path.join(self.settings.jabia_path, name) for name in self.settings.file_list[i + 1:]]
+            # not every install has every pak file
+            later = [filepath for filepath in later if os.path.exists(filepath)]
+            if len(later) > 0:
+                cmd += ["--overridden-by"] + later
+            wx.CallAfter(self.status.AppendText, " ".join(cmd) + "\n\n")
+            cmd += ["--progress"]
             # piping pak_magick's output to avoid http://www.pyinstaller.org/ticket/6
-            proc = subprocess.call(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            output = []
+            for line in iter(proc.stdout.readline, ""):
+                fields = line.split()
+                if len(fields) == 9 and fields[0] == "PROGRESS":
+                    message = (fields[1],) + tuple(int(field) for field in fields[2:6]) + \
+                        tuple(float(field) for field in fields[6:])
+                    wx.CallAfter(pub.sendMessage, "EXTRACT_PROGRESS", message=message)
+                elif line.startswith("Extracted") or line.startswith("Timings"):
+                    wx.CallAfter(self.status.AppendText, line)
+                else:
+                    output.append(line)
+            if proc.wait() != 0:
+                # the rest of the output usually holds the traceback
+                wx.CallAfter(self.status.AppendText, "".join(output) + 
+                             "pak_magick failed on %s with exit code %i\n\n" % (file, proc.returncode))
                     
         self.mywiz.FindWindowById(wx.ID_FORWARD).Enable()
         self.mywiz.FindWindowById(wx.ID_BACKWARD).Disable()
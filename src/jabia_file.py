@@ -49,8 +49,7 @@ class JABIA_file(object):
         print "Creating %s" % self.filepath
          
         with open(self.filepath, "wb") as f:            
-            data = self.data.get_packed_data()
-            f.write(data)
+            self.data.write_to(f)
 
     def unpack(self, peek=False, verbose=False):
         with open(self.filepath, "rb") as f:            
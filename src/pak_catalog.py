@@ -0,0 +1,163 @@
+"""
+Created on October 17, 2026
+"""
+"""
+    Copyright (C) 2026 JA-BiA-Tools contributors
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import posixpath
+import sqlite3
+from pak_vfs import find_archives, open_archive
+
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS Archive(archive_id INTEGER PRIMARY KEY, filepath TEXT UNIQUE, name TEXT,
+                                   size INT, mtime REAL, descriptor_size INT, number_files INT);
+CREATE TABLE IF NOT EXISTS Member(archive_id INT, dir TEXT, name TEXT, extension TEXT, path TEXT,
+                                  size INT, offset INT, crc INT);
+CREATE INDEX IF NOT EXISTS Member_archive ON Member(archive_id);
+CREATE INDEX IF NOT EXISTS Member_path ON Member(path);
+CREATE INDEX IF NOT EXISTS Member_dir ON Member(dir);
+CREATE INDEX IF NOT EXISTS Member_extension ON Member(extension, size);
+CREATE INDEX IF NOT EXISTS Member_content ON Member(size, crc);
+"""
+
+def to_signed(value):
+    """ SQLite integers are signed 64 bit, the crc field is unsigned. """
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+def is_in(filepath, root):
+    """ True if filepath is root, or an archive directly in the directory root the way find_archives lists them. """
+    filepath = os.path.normcase(os.path.abspath(filepath))
+    root = os.path.normcase(os.path.abspath(root))
+    return filepath == root or os.path.dirname(filepath) == root
+
+class PAK_catalog:
+    """ SQLite database of the directory tables of every archive of an install.
+    
+    Only the descriptors are read, an encrypted archive only has its descriptor decrypted.
+    An archive is indexed again only when its size or modification time changed, each archive
+    is replaced in a single transaction with one bulk insert.
+    """
+    def __init__(self, db_filepath):
+        self.db_filepath = db_filepath
+        self.con = sqlite3.connect(db_filepath)
+        self.con.execute("PRAGMA synchronous = NORMAL")
+        self.con.executescript(CATALOG_SCHEMA)
+    
+    def get_archives(self):
+        """ Returns the {file path : (archive id, size, mtime)} mapping of the catalogued archives. """
+        rows = self.con.execute("SELECT filepath, archive_id, size, mtime FROM Archive").fetchall()
+        return dict((row[0], tuple(row[1:])) for row in rows)
+    
+    def add_archive(self, filepath, sidecar=None, cache=None):
+        """ Replace the members of one archive, returns the number of members. """
+        stat = os.stat(filepath)
+        pak_file = open_archive(filepath, cache)
+        try:
+            index = pak_file.get_index(sidecar)
+        finally:
+            pak_file.close()
+        
+        def get_rows(archive_id):
+            for path, offset, size, crc in index:
+                dir, name = posixpath.split(path)
+                extension = posixpath.splitext(name)[1][1:].lower()
+                yield archive_id, dir, name, extension, path, size, offset, to_signed(crc)
+        
+        with self.con:
+            row = self.con.execute("SELECT archive_id FROM Archive WHERE filepath = ?", (filepath,)).fetchone()
+            if row is not None:
+                self.con.execute("DELETE FROM Member WHERE archive_id = ?", row)
+                self.con.execute("DELETE FROM Archive WHERE archive_id = ?", row)
+            cursor = self.con.execute("INSERT INTO Archive VALUES(NULL, ?, ?, ?, ?, ?, ?)",
+                                      (filepath, os.path.basename(filepath), stat.st_size, stat.st_mtime,
+                                       index.descriptor_size, len(index)))
+            self.con.executemany("INSERT INTO Member VALUES(?, ?, ?, ?, ?, ?, ?, ?)", get_rows(cursor.lastrowid))
+        return len(index)
+    
+    def remove_archive(self, filepath):
+        with self.con:
+            row = self.con.execute("SELECT archive_id FROM Archive WHERE filepath = ?", (filepath,)).fetchone()
+            if row is not None:
+                self.con.execute("DELETE FROM Member WHERE archive_id = ?", row)
+                self.con.execute("DELETE FROM Archive WHERE archive_id = ?", row)
+    
+    def refresh(self, archive_list, sidecar=None, cache=None, verbose=False, root=None):
+        """ Bring the catalog in line with archive_list, returns (archives indexed, archives removed).
+        
+        Only catalogued archives in root that are not in archive_list are removed, archives
+        of other installs stay in the catalog. Without a root nothing is removed.
+        """
+        archive_list = [os.path.abspath(filepath) for filepath in archive_list]
+        catalogued = self.get_archives()
+        indexed = 0
+        for filepath in archive_list:
+            stat = os.stat(filepath)
+            entry = catalogued.get(filepath)
+            if entry is not None and entry[1] == stat.st_size and entry[2] == stat.st_mtime:
+                continue
+            count = self.add_archive(filepath, sidecar, cache)
+            indexed += 1
+            if verbose:
+                print "Indexed %s, %i files" % (filepath, count)
+        removed = 0
+        for filepath in set(catalogued) - set(archive_list):
+            if root is None or not is_in(filepath, root):
+                continue
+            self.remove_archive(filepath)
+            removed += 1
+            if verbose:
+                print "Removed %s" % filepath
+        return indexed, removed
+    
+    def refresh_install(self, jabia_path, sidecar=None, cache=None, verbose=False):
+        return self.refresh(find_archives(jabia_path), sidecar, cache, verbose, jabia_path)
+    
+    def query(self, sql, parameters=()):
+        return self.con.execute(sql, parameters).fetchall()
+    
+    def get_largest(self, extension=None, limit=20):
+        """ Returns (archive, path, size) of the largest members, of one extension if given. """
+        sql = "SELECT Archive.name, path, Member.size FROM Member JOIN Archive USING(archive_id)"
+        parameters = ()
+        if extension is not None:
+            sql += " WHERE extension = ?"
+            parameters = (extension.lstrip(".").lower(),)
+        return self.query(sql + " ORDER BY Member.size DESC LIMIT %i" % limit, parameters)
+    
+    def get_duplicates(self):
+        """ Returns (size, crc, number of copies, paths) of members with the same size and crc. """
+        return self.query("SELECT size, crc, count(*), group_concat(path, ' ') FROM Member WHERE size > 0 "
+                          "GROUP BY size, crc HAVING count(*) > 1 ORDER BY size * (count(*) - 1) DESC")
+    
+    def get_under(self, dir):
+        """ Returns (archive, path, size) of every member below a directory. """
+        dir = dir.replace("\\", "/").strip("/")
+        if dir == "":
+            return self.query("SELECT Archive.name, path, Member.size FROM Member JOIN Archive USING(archive_id) "
+                              "ORDER BY path")
+        return self.query("SELECT Archive.name, path, Member.size FROM Member JOIN Archive USING(archive_id) "
+                          "WHERE dir = ? OR dir GLOB ? ORDER BY path", (dir, dir + "/*"))
+    
+    def close(self):
+        self.con.close()
+
+if __name__ == "__main__":
+    catalog = PAK_catalog("jabia_catalog.sqlite")
+    print catalog.refresh_install("C:\Program Files (x86)\Steam\steamapps\common\jabia", verbose=True)
+    for row in catalog.get_largest("dds"):
+        print row
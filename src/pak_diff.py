@@ -0,0 +1,108 @@
+"""
+Created on October 17, 2026
+"""
+"""
+    Copyright (C) 2026 JA-BiA-Tools contributors
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from pak_file import PAK_CHUNK_SIZE, PAK_writer, PAK_CRYPT_writer
+
+def compare_members(old_pak, old_offset, new_pak, new_offset, size, chunk_size=PAK_CHUNK_SIZE):
+    """ Compare two members of the same size chunk by chunk, stops at the first chunk that differs. """
+    for position in xrange(0, size, chunk_size):
+        length = min(chunk_size, size - position)
+        # views of plain archives are buffers and of encrypted ones strings, buffers compare by content
+        if buffer(old_pak.get_view(old_offset + position, length)) != \
+            buffer(new_pak.get_view(new_offset + position, length)):
+            return False
+    return True
+
+class PAK_diff:
+    """ Differences between two versions of an archive, worked out from their directory tables.
+    
+    A member with a different size changed, one with the same size and crc did not. Only members
+    with the same size and a different crc are compared byte by byte, since it is not known what
+    the crc field covers. With confirm set members that look unchanged are compared as well.
+    """
+    def __init__(self, old_pak, new_pak, member_filter=None, confirm=False):
+        self.old_pak = old_pak
+        self.new_pak = new_pak
+        self.added = []     # paths only in the new archive, in table order
+        self.removed = []   # paths only in the old archive, in table order
+        self.changed = []   # paths in both archives with different data
+        self.unchanged = 0
+        self.compared_bytes = 0 # member data read to tell members apart
+        
+        old_index = old_pak.get_index()
+        new_index = new_pak.get_index()
+        for path, new_offset, size, crc in new_index:
+            if member_filter is not None and not member_filter.match(path):
+                continue
+            if path not in old_index:
+                self.added.append(path)
+                continue
+            old_offset, old_size, old_crc = old_index.find(path)
+            if old_size != size:
+                self.changed.append(path)
+            elif old_crc != crc or confirm:
+                self.compared_bytes += size
+                if compare_members(old_pak, old_offset, new_pak, new_offset, size):
+                    self.unchanged += 1
+                else:
+                    self.changed.append(path)
+            else:
+                self.unchanged += 1
+        for path, _, _, _ in old_index:
+            if path not in new_index and (member_filter is None or member_filter.match(path)):
+                self.removed.append(path)
+    
+    def is_empty(self):
+        return len(self.added) == 0 and len(self.removed) == 0 and len(self.changed) == 0
+    
+    def dump(self):
+        for path in self.added:
+            print "A %s" % path
+        for path in self.changed:
+            print "M %s" % path
+        for path in self.removed:
+            print "D %s" % path
+    
+    def write_patch(self, filepath, cipher=None, verbose=False):
+        """ Write the added and changed members into a new archive, encrypted if cipher is given.
+        
+        The data is copied straight from the new archive. Removed members can not be expressed
+        in a pak file, the game keeps loading them from the old archive.
+        """
+        if cipher is not None:
+            pak_writer = PAK_CRYPT_writer(filepath, cipher)
+        else:
+            pak_writer = PAK_writer(filepath)
+        new_index = self.new_pak.get_index()
+        for path in self.added + self.changed:
+            offset, size, crc = new_index.find(path)
+            pak_writer.add_file(path, (self.new_pak, offset), size, crc)
+        pak_writer.write(verbose)
+        return pak_writer
+
+if __name__ == "__main__":
+    import sys
+    from pak_file import PAK_file
+    # pak_diff.py OLD NEW PATCH
+    old_pak = PAK_file(sys.argv[1])
+    new_pak = PAK_file(sys.argv[2])
+    diff = PAK_diff(old_pak, new_pak)
+    diff.dump()
+    diff.write_patch(sys.argv[3])
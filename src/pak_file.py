@@ -23,16 +23,111 @@ Created on February 2, 2012
 import struct 
 import os
 import sys
-import cStringIO
+import mmap
+import ctypes
+import posixpath
+import fnmatch
+import re
+import threading
+import time
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import base64
+import hashlib
+import zlib
+from collections import OrderedDict
+from contextlib import closing, contextmanager
 from Crypto.Cipher import AES
 
 PAK_SIGNATURE = 0x504B4C4501000000
 AES_KEY_CIPHERED = {"JABIA_JAC" : "eFd1cnozbFBFVEVSMjUzeg==",
                     "DLC5" : "MTNIYW5zZWxuMTBFbGYlIQ==",
                     "DLC6" : "MTNIYW5zZWxuMTBFbGYlIQ=="}
-PAK_filesize = 0 # in bytes
-PAK_bytes_unpacked = 0
+PAK_INDEX_SIGNATURE = "JABIAIDX"
+PAK_INDEX_VERSION = 1
+PAK_INDEX_EXTENSION = ".idx"
+PAK_CRYPT_CACHE_SIZE = 1024 * 1024 * 1024 # in bytes
+PAK_CHUNK_SIZE = 1024 * 1024 # in bytes, largest piece of a member held in memory while copying
+
+def load_libc_function(name, argtypes, restype=ctypes.c_int):
+    """ Return a libc function the os module does not expose, or None where it does not exist. """
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        function = getattr(ctypes.CDLL("libc.so.6", use_errno=True), name)
+    except (OSError, AttributeError):
+        return None
+    function.argtypes = argtypes
+    function.restype = restype
+    return function
+
+posix_fadvise = load_libc_function("posix_fadvise64", [ctypes.c_int, ctypes.c_int64, ctypes.c_int64, ctypes.c_int])
+sendfile = load_libc_function("sendfile64", [ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t], 
+                              ctypes.c_ssize_t)
+POSIX_FADV_SEQUENTIAL = 2
+POSIX_FADV_WILLNEED = 3
+
+def readahead(file_pointer, offset, length, advice=POSIX_FADV_WILLNEED):
+    """ Tell the OS which part of the archive is read next, does nothing where that is not supported. """
+    if posix_fadvise is not None and hasattr(file_pointer, "fileno"):
+        posix_fadvise(file_pointer.fileno(), offset, length, advice)
+
+def kernel_copy(in_file, offset, size, out_file):
+    """ Copy a byte range between two files without passing it through user space.
+    
+    The input file position is not used or changed. Returns the number of bytes copied, 
+    which is less than size if the kernel cannot copy between these files. 
+    """
+    if sendfile is None or not hasattr(in_file, "fileno") or not hasattr(out_file, "fileno"):
+        return 0
+    out_file.flush()
+    position = ctypes.c_int64(offset)
+    copied = 0
+    while copied < size:
+        count = sendfile(out_file.fileno(), in_file.fileno(), ctypes.byref(position), min(size - copied, 0x7ffff000))
+        if count <= 0:
+            break
+        copied += count
+    return copied
+
+def add_time(timings, phase, start):
+    """ Add the seconds since start to timings[phase] if timings is not None, returns the current time. """
+    now = time.time()
+    if timings is not None:
+        timings[phase] = timings.get(phase, 0.0) + now - start
+    return now
+
+decrypt_clock = threading.local()   # seconds the current thread spent decrypting
+
+def get_thread_decrypt_time():
+    return getattr(decrypt_clock, "seconds", 0.0)
+
+def add_read_time(timings, start, decrypted):
+    """ add_time for "read", without the decryption done by this thread since get_thread_decrypt_time() 
+    returned decrypted. Decryption is counted as "decrypt" by the archive itself.
+    """
+    return add_time(timings, "read", start + get_thread_decrypt_time() - decrypted)
+
+def copy_range(in_file, offset, size, out_file, chunk_size=PAK_CHUNK_SIZE, timings=None):
+    """ Copy size bytes at offset from in_file to out_file, holding at most chunk_size bytes in memory. 
+    
+    Time spent reading and writing is added to the optional timings dict, a copy done 
+    by the kernel counts as writing.
+    """
+    start = time.time()
+    copied = kernel_copy(in_file, offset, size, out_file)
+    start = add_time(timings, "write", start)
+    if copied < size:
+        in_file.seek(offset + copied)
+        while copied < size:
+            decrypted = get_thread_decrypt_time()
+            data = in_file.read(min(chunk_size, size - copied))
+            if not data:
+                raise IOError("Unexpected end of archive at offset %s" % hex(offset + copied).rstrip('L'))
+            start = add_read_time(timings, start, decrypted)
+            out_file.write(data)
+            start = add_time(timings, "write", start)
+            copied += len(data)
 
 
 class PAK_data:
@@ -44,17 +139,21 @@ class PAK_data:
         self.file_name = None   # includes '\0'                
         self.data = None
     
-    def unpack(self, dir, file_pointer, dest_filepath, verbose=False):
+    def parse(self, dir, file_pointer):
         self.file_directory = dir
         self.file_name_length, self.file_size, self.file_offset, self.file_crc = struct.unpack('<IQQQ', file_pointer.read(28))
         
         self.file_name = file_pointer.read(self.file_name_length)
         # strip the null
         self.file_name = self.file_name.replace("\00", "").strip()
+    
+    def get_path(self):
+        return member_path(self.file_directory, self.file_name)
+    
+    def unpack(self, dir, file_pointer, dest_filepath, verbose=False, session=None):
+        self.parse(dir, file_pointer)
         
         saved_pointer = file_pointer.tell()
-        file_pointer.seek(self.file_offset)
-        self.data = file_pointer.read(self.file_size)
         
         if verbose:
             print "File name: %s" % os.path.join(self.file_directory,self.file_name)
@@ -65,20 +164,18 @@ class PAK_data:
             #print "File CRC32 %s" % hex(zlib.crc32(self.data) & 0xffffffff )
             print 
         
-        global PAK_bytes_unpacked
-        PAK_bytes_unpacked += float(self.file_size)
-        
-        sys.stdout.write("%.0f%%\r" % (PAK_bytes_unpacked * 100/ PAK_filesize) )
-
-        #print "%i\r" % PAK_bytes_unpacked
         path = os.path.join(dest_filepath, self.file_directory)
         
         if not os.path.exists(path):
             os.makedirs(path)
             
+        # the data is streamed, only a chunk of it is in memory at a time
+        timings = {}
         with open(os.path.join(path, self.file_name), "wb") as f:
-            f.write(self.data)
+            copy_range(file_pointer, self.file_offset, self.file_size, f, timings=timings)
         file_pointer.seek(saved_pointer)
+        if session is not None:
+            session.progress(1, self.file_size, timings)
         
 class PAK_dir:
     def __init_(self, dir):
@@ -89,17 +186,29 @@ class PAK_dir:
                 
             
     
-    def unpack(self, file_pointer, dest_filepath, verbose=False):        
+    def parse_header(self, file_pointer):
         self.dir_index, self.dir_name_length, self.dir_number_files = struct.unpack('<IIQ', file_pointer.read(16))
         self.dir_name = file_pointer.read(self.dir_name_length)
         
         # strip the null and remove leading slash
         self.dir_name = self.dir_name.replace("\00", "").strip()[1:]
+    
+    def parse(self, file_pointer):
+        """ Read the directory record and its file records without touching the file data. """
+        self.parse_header(file_pointer)
+        self.file_list = []
+        for i in range(0, self.dir_number_files):
+            pF = PAK_data()
+            pF.parse(self.dir_name, file_pointer)
+            self.file_list.append(pF)
+    
+    def unpack(self, file_pointer, dest_filepath, verbose=False, session=None):        
+        self.parse_header(file_pointer)
         
         if self.dir_number_files != 0:
             for i in range(0, self.dir_number_files):
                 pF = PAK_data()
-                pF.unpack(self.dir_name, file_pointer, dest_filepath, verbose)
+                pF.unpack(self.dir_name, file_pointer, dest_filepath, verbose, session)
         else:            
             return 
         
@@ -109,35 +218,295 @@ class PAK_header:
         self.descriptor_size = None # in bytes
         self.num_dirs = None
     
-    def unpack(self, file_pointer, dest_filepath, verbose=False):    
+    def parse_header(self, file_pointer):
         self.magic, = struct.unpack(">Q", file_pointer.read(8))
         
         if self.magic != PAK_SIGNATURE:            
+            return False
+        
+        self.descriptor_size, self.num_dirs = struct.unpack("<QQ", file_pointer.read(16))
+        return True
+    
+    def parse(self, file_pointer):
+        """ Read the whole directory table, no file data is read. """
+        self.dir_list = []
+        if not self.parse_header(file_pointer):
+            raise Exception("File is not BiA pak")
+        
+        for i in range(0, self.num_dirs):
+            pD = PAK_dir()
+            pD.parse(file_pointer)
+            self.dir_list.append(pD)
+    
+    def unpack(self, file_pointer, dest_filepath, verbose=False, session=None):    
+        if not self.parse_header(file_pointer):
             # something bad happened
             print "File is not BiA pak"
             return
         
-        self.descriptor_size, self.num_dirs = struct.unpack("<QQ", file_pointer.read(16))     
-        global PAK_filesize   
-        PAK_filesize -= self.descriptor_size
+        position = file_pointer.tell()
+        file_pointer.seek(0, os.SEEK_END)
+        content_size = file_pointer.tell() - self.descriptor_size
+        file_pointer.seek(position)
+        if session is not None:
+            session.start(0, content_size)
         
         if verbose:
             print "Descriptor size: %i bytes" % self.descriptor_size
-            print "Content size: %i bytes" % PAK_filesize
+            print "Content size: %i bytes" % content_size
             print "Number of directories in archive: %i" % self.num_dirs
             
         for i in range(0, self.num_dirs):
             pD = PAK_dir()
-            pD.unpack(file_pointer, dest_filepath, verbose)
+            pD.unpack(file_pointer, dest_filepath, verbose, session)
+        if session is not None:
+            session.finish()
             
+class PAK_index:
+    """ Table of contents of an archive, built from the descriptor block alone.
+    
+    Offsets, sizes and crcs are kept packed in one bytearray, 24 bytes per member,
+    in the order the members appear in the directory table.
+    """
+    record = struct.Struct("<QQQ")
+    sidecar_header = struct.Struct("<8sIQdQQQII")
+    
+    def __init__(self):
+        self.descriptor_size = 0
+        self.dir_list = []          # directory names, including empty directories
+        self.path_list = []
+        self.records = bytearray()  # packed (offset, size, crc) 
+        self.lookup = {}            # {path : position in path_list} mapping
+        
+    def __len__(self):
+        return len(self.path_list)
+    
+    def __contains__(self, path):
+        return normalize_path(path) in self.lookup
+    
+    def __iter__(self):
+        """ Yields (path, offset, size, crc) in directory table order. """
+        for i in xrange(0, len(self.path_list)):
+            offset, size, crc = self.record.unpack_from(self.records, i * self.record.size)
+            yield self.path_list[i], offset, size, crc
+            
+    def add(self, path, offset, size, crc):
+        self.lookup[path] = len(self.path_list)
+        self.path_list.append(path)
+        self.records += self.record.pack(offset, size, crc)
+        
+    def find(self, path):
+        """ Return (offset, size, crc) of a member. """
+        i = self.lookup.get(normalize_path(path))
+        if i is None:
+            raise KeyError("%s is not in archive" % path)
+        return self.record.unpack_from(self.records, i * self.record.size)
+    
+    def get_content_size(self):
+        return sum(size for _, _, size, _ in self)
+    
+    def fill(self, block, file_pointer, end):
+        if end > len(block):
+            block += file_pointer.read(end - len(block) + 0x10000)
+        return block
+    
+    def build(self, file_pointer):
+        """ Parse the descriptor block with a single read where possible. """
+        header = PAK_header()
+        if not header.parse_header(file_pointer):
+            raise Exception("File is not BiA pak")
+        self.descriptor_size = header.descriptor_size
+        
+        # the block is grown on demand in case descriptor_size does not cover the whole table
+        block = file_pointer.read(max(header.descriptor_size - 24, 0))
+        position = 0
+        for i in xrange(0, header.num_dirs):
+            block = self.fill(block, file_pointer, position + 16)
+            _, dir_name_length, dir_number_files = struct.unpack_from("<IIQ", block, position)
+            position += 16
+            block = self.fill(block, file_pointer, position + dir_name_length)
+            dir_name = block[position:position + dir_name_length].replace("\00", "").strip()[1:]
+            position += dir_name_length
+            self.dir_list.append(dir_name)
+            
+            for j in xrange(0, dir_number_files):
+                block = self.fill(block, file_pointer, position + 28)
+                file_name_length, file_size, file_offset, file_crc = struct.unpack_from("<IQQQ", block, position)
+                position += 28
+                block = self.fill(block, file_pointer, position + file_name_length)
+                file_name = block[position:position + file_name_length].replace("\00", "").strip()
+                position += file_name_length
+                self.add(member_path(dir_name, file_name), file_offset, file_size, file_crc)
+        return self
+    
+    def save(self, sidecar_path, archive_size, archive_mtime):
+        dirs = "\00".join(self.dir_list)
+        paths = "\00".join(self.path_list)
+        with open(sidecar_path, "wb") as f:
+            f.write(self.sidecar_header.pack(PAK_INDEX_SIGNATURE, PAK_INDEX_VERSION, archive_size, archive_mtime, 
+                                             self.descriptor_size, len(self.dir_list), len(self.path_list), 
+                                             len(dirs), len(paths)))
+            f.write(self.records)
+            f.write(dirs)
+            f.write(paths)
+    
+    def load(self, sidecar_path, archive_size, archive_mtime):
+        """ Load a sidecar, returns False if it is missing or does not match the archive. """
+        if not os.path.exists(sidecar_path):
+            return False
+        with open(sidecar_path, "rb") as f:
+            data = f.read()
+        if len(data) < self.sidecar_header.size:
+            return False
+        signature, version, size, mtime, descriptor_size, num_dirs, count, dirs_length, paths_length = \
+            self.sidecar_header.unpack_from(data, 0)
+        if signature != PAK_INDEX_SIGNATURE or version != PAK_INDEX_VERSION or \
+            size != archive_size or mtime != archive_mtime:
+            return False
+        position = self.sidecar_header.size
+        self.descriptor_size = descriptor_size
+        self.records = bytearray(data[position:position + count * self.record.size])
+        position += count * self.record.size
+        self.dir_list = data[position:position + dirs_length].split("\00") if num_dirs > 0 else []
+        position += dirs_length
+        self.path_list = data[position:position + paths_length].split("\00") if count > 0 else []
+        self.lookup = dict((path, i) for i, path in enumerate(self.path_list))
+        return True
+    
+    def __str__(self):
+        return "Number of directories: %i, number of files: %i" % (len(self.dir_list), len(self.path_list))
+
+class PAK_member:
+    """ Read-only file-like view of a single archive member.
+    
+    Every read is a positional slice of the archive mapping, so views of the same archive
+    can be used from several threads at once. 
+    """
+    def __init__(self, path, view):
+        self.name = path
+        self.view = view
+        self.size = len(view)
+        self.position = 0
+    
+    def read(self, size=-1):
+        if size is None or size < 0:
+            end = self.size
+        else:
+            end = min(self.position + size, self.size)
+        data = self.view[self.position:end]
+        self.position = max(self.position, end)
+        return data
+    
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise IOError("Invalid seek offset %i" % offset)
+        self.position = offset
+    
+    def tell(self):
+        return self.position
+    
+    def close(self):
+        self.view = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        
+    def __str__(self):
+        return "PAK member: %s, %i bytes" % (self.name, self.size)
+
+class PAK_range:
+    """ Lazy view of size bytes at offset of an archive, only the slices that are taken are read. 
+    
+    Used as the view of a PAK_member when the member should not be read or decrypted at once.
+    """
+    def __init__(self, pak_file, offset, size):
+        self.pak_file = pak_file
+        self.offset = offset
+        self.size = size
+    
+    def __len__(self):
+        return self.size
+    
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            raise TypeError("PAK_range only supports slices")
+        start, stop, _ = key.indices(self.size)
+        return self.pak_file.get_view(self.offset + start, max(0, stop - start))
+    
+    def __getslice__(self, start, stop):
+        return self.__getitem__(slice(start, stop))
+
+def get_page_count(offset, size, page_size):
+    """ Number of pages the byte range touches. """
+    if size == 0:
+        return 0
+    return (offset + size - 1) / page_size - offset / page_size + 1
+
+def member_path(dir, file_name):
+    """ Archive paths always use forward slashes and have no leading slash. """
+    return posixpath.join(dir.replace("\\", "/").strip("/"), file_name)
+
+def normalize_path(path):
+    return path.replace("\\", "/").lstrip("/")
+
+class PAK_filter:
+    """ Selects archive members by path, before any of their data is read.
+    
+    Glob patterns match the whole path or any tail of it that starts at a directory, so "*.ctx" 
+    and "configs/*.txt" work without spelling out the full path, a leading "/" anchors a pattern 
+    to the root. With regex=True patterns are regular expressions searched for in the path.
+    A member is selected if it matches any include pattern, or there are none, and no exclude pattern.
+    """
+    def __init__(self, include=None, exclude=None, regex=False):
+        self.include = [self.compile(pattern, regex) for pattern in include or []]
+        self.exclude = [self.compile(pattern, regex) for pattern in exclude or []]
+    
+    def compile(self, pattern, regex):
+        """ Returns (kind, compiled expression), kind is "regex", "glob" or "anchored". """
+        if regex:
+            return "regex", re.compile(pattern)
+        pattern = pattern.replace("\\", "/")
+        kind = "anchored" if pattern.startswith("/") else "glob"
+        return kind, re.compile(fnmatch.translate(pattern.lstrip("/")))
+    
+    def match_pattern(self, pattern, path):
+        kind, expression = pattern
+        if kind == "regex":
+            return expression.search(path) is not None
+        if expression.match(path):
+            return True
+        if kind == "anchored":
+            return False
+        position = path.find("/")
+        while position != -1:
+            if expression.match(path, position + 1):
+                return True
+            position = path.find("/", position + 1)
+        return False
+    
+    def match(self, path):
+        if len(self.include) > 0 and not any(self.match_pattern(pattern, path) for pattern in self.include):
+            return False
+        return not any(self.match_pattern(pattern, path) for pattern in self.exclude)
+
 class PAK_file:
     def __init__(self, filepath=None):
         self.filepath = filepath
+        self.plain_filepath = None  # unencrypted archive on disk
         self.header = None        
+        self.index = None
+        self.map = None
+        self.map_file = None
+        self.map_lock = threading.Lock()
         
         if self.filepath != None:
-            global PAK_filesize
-            PAK_filesize = os.path.getsize(filepath)
             self.open(filepath)
     
     def open(self, filepath=None, peek=False):
@@ -147,13 +516,314 @@ class PAK_file:
         if self.filepath == None:
             self.filepath = filepath
         
+        self.plain_filepath = self.filepath
         self.header = PAK_header()
 
-    def dump(self, dest_filepath=os.getcwd(), verbose=False):
+    def dump(self, dest_filepath=os.getcwd(), verbose=False, session=None):
+        if session is None:
+            session = PAK_session([print_progress])
         with open(self.filepath, "rb") as f:            
-            self.header.unpack(f, dest_filepath, verbose)
+            self.header.unpack(f, dest_filepath, verbose, session)
+        return session
+    
+    def open_plain(self):
+        """ Return a file object over the unencrypted archive. """
+        return open(self.plain_filepath, "rb")
+    
+    def read_directory(self):
+        """ Parse the directory table into PAK_dir and PAK_data objects, no file data is read. """
+        header = PAK_header()
+        with closing(self.open_plain()) as f:
+            header.parse(f)
+        return header
+    
+    def get_sidecar_path(self, sidecar_dir=None):
+        if sidecar_dir is None:
+            return self.filepath + PAK_INDEX_EXTENSION
+        return os.path.join(sidecar_dir, os.path.basename(self.filepath) + PAK_INDEX_EXTENSION)
+    
+    def get_index(self, sidecar=None):
+        """ Return the table of contents of the archive.
+        
+        If sidecar is True the index is cached next to the archive, if it is a directory it is cached 
+        there under the name of the archive. A cached index is only used while the archive size and 
+        modification time match. 
+        """
+        if self.index is not None:
+            return self.index
+        index = PAK_index()
+        if sidecar:
+            sidecar = self.get_sidecar_path(None if sidecar is True else sidecar)
+            stat = os.stat(self.filepath)
+            if not index.load(sidecar, stat.st_size, stat.st_mtime):
+                with closing(self.open_plain()) as f:
+                    index.build(f)
+                index.save(sidecar, stat.st_size, stat.st_mtime)
+        else:
+            with closing(self.open_plain()) as f:
+                index.build(f)
+        self.index = index
+        return self.index
+    
+    def get_map(self):
+        """ Map the archive read-only, returns None if it does not fit in the address space. """
+        with self.map_lock:
+            if self.map_file is None:
+                self.map_file = open(self.plain_filepath, "rb")
+                try:
+                    self.map = mmap.mmap(self.map_file.fileno(), 0, access=mmap.ACCESS_READ)
+                except (OverflowError, EnvironmentError, ValueError):
+                    # 32 bit process and a multi-GB archive, members will be mapped one by one
+                    self.map = None
+        return self.map
+    
+    def get_view(self, offset, size):
+        if size == 0:
+            return buffer("")
+        archive_map = self.get_map()
+        if archive_map is not None:
+            return buffer(archive_map, offset, size)
+        start = offset - offset % mmap.ALLOCATIONGRANULARITY
+        window = mmap.mmap(self.map_file.fileno(), offset - start + size, access=mmap.ACCESS_READ, offset=start)
+        return buffer(window, offset - start, size)
+    
+    def read_member(self, path):
+        """ Return a zero-copy buffer over the member data. """
+        offset, size, _ = self.get_index().find(path)
+        return self.get_view(offset, size)
+    
+    def open_member(self, path):
+        """ Return a file-like object over the member data. """
+        return PAK_member(path, self.read_member(path))
+    
+    def copy_member(self, offset, size, out_file, chunk_size=PAK_CHUNK_SIZE, timings=None):
+        """ Stream member data to out_file, through the kernel where possible. Safe to use from several threads. 
+        
+        Pages of the map are only read when they are written out, so that time counts as writing.
+        """
+        self.get_map()
+        start = time.time()
+        copied = kernel_copy(self.map_file, offset, size, out_file)
+        start = add_time(timings, "write", start)
+        for position in xrange(copied, size, chunk_size):
+            data = self.get_view(offset + position, min(chunk_size, size - position))
+            start = add_time(timings, "read", start)
+            out_file.write(data)
+            start = add_time(timings, "write", start)
+    
+    def get_decrypt_time(self):
+        """ Seconds spent decrypting this archive so far. """
+        return 0.0
+    
+    def extract(self, dest_filepath=os.getcwd(), jobs=1, processes=False, sequential=False, memory_limit=None, 
+                incremental=False, member_filter=None, verbose=False, session=None, overrides=None):
+        """ Extract the archive with a pool of jobs threads, or processes if processes is True. 
+        
+        If sequential is True the data is read in offset order with large coalesced reads.
+        memory_limit caps the member data all workers together hold in memory, in bytes.
+        If incremental is True members that are unchanged since the last extraction are skipped.
+        member_filter is an optional PAK_filter, only the members it matches are extracted.
+        overrides is an optional set of paths that archives loaded after this one supply, 
+        they are left to those archives.
+        Progress is reported to session, a PAK_session that prints a percentage by default. 
+        Returns the session.
+        """
+        if session is None:
+            session = PAK_session([print_progress])
+        PAK_extractor(self, dest_filepath, jobs, processes, sequential, memory_limit, incremental, member_filter, 
+                      verbose, session, overrides).run()
+        return session
+    
+    def close(self):
+        with self.map_lock:
+            if self.map is not None:
+                self.map.close()
+                self.map = None
+            if self.map_file is not None:
+                self.map_file.close()
+                self.map_file = None
+
+class PAK_CRYPT_reader:
+    """ Decrypts the parts of a pak.crypt file that are read, instead of the whole file.
+    
+    The archive is AES-ECB encrypted, so every 16 byte block can be decrypted on its own. 
+    Small reads go through a cache of decrypted pages, large reads are decrypted directly. 
+    read_at does not depend on a file position and can be used from several threads.
+    """
+    header_size = 0xa
+    page_size = 64 * 1024   # in bytes, a multiple of the AES block size
+    cache_pages = 16
+    
+    def __init__(self, filepath, cipher=None):
+        self.file = open(filepath, "rb")
+        _, self.real_size, self.block_size = struct.unpack("<HII", self.file.read(self.header_size))
+        self.lock = threading.Lock()
+        self.pages = OrderedDict()  # {page number : plaintext} mapping, least recently used first
+        self.decrypt_time = 0.0     # in seconds
+        if cipher is None:
+            cipher = self.find_cipher()
+        self.cipher = cipher
+        self.aes = AES.new(base64.b64decode(AES_KEY_CIPHERED[cipher]), AES.MODE_ECB)
+    
+    def find_cipher(self):
+        """ Try every known key on the first block, it has to start with the pak signature. """
+        block = self.read_encrypted(0, AES.block_size)
+        for cipher in sorted(AES_KEY_CIPHERED):
+            aes = AES.new(base64.b64decode(AES_KEY_CIPHERED[cipher]), AES.MODE_ECB)
+            magic, = struct.unpack(">Q", aes.decrypt(block)[:8])
+            if magic == PAK_SIGNATURE:
+                return cipher
+        raise Exception("File is not BiA pak.crypt or is encrypted with an unknown key")
+    
+    def read_encrypted(self, offset, size):
+        with self.lock:
+            self.file.seek(self.header_size + offset)
+            return self.file.read(size)
+    
+    def decrypt(self, data):
+        start = time.time()
+        data = self.aes.decrypt(data)
+        elapsed = time.time() - start
+        decrypt_clock.seconds = get_thread_decrypt_time() + elapsed
+        with self.lock:
+            self.decrypt_time += elapsed
+        return data
+    
+    def get_page(self, page_number):
+        with self.lock:
+            page = self.pages.pop(page_number, None)
+            if page is not None:
+                self.pages[page_number] = page
+                return page
+        offset = page_number * self.page_size
+        page = self.decrypt(self.read_encrypted(offset, min(self.page_size, self.block_size - offset)))
+        with self.lock:
+            self.pages[page_number] = page
+            if len(self.pages) > self.cache_pages:
+                self.pages.popitem(last=False)
+        return page
+    
+    def read_at(self, offset, size):
+        size = max(0, min(size, self.real_size - offset))
+        if size == 0:
+            return ""
+        if size >= self.page_size:
+            start = offset - offset % AES.block_size
+            end = offset + size
+            end = min(end + (-end) % AES.block_size, self.block_size)
+            data = self.decrypt(self.read_encrypted(start, end - start))
+            return data[offset - start:offset - start + size]
+        pieces = []
+        position = offset
+        while position < offset + size:
+            page_number = position / self.page_size
+            page_offset = position - page_number * self.page_size
+            piece = self.get_page(page_number)[page_offset:page_offset + offset + size - position]
+            pieces.append(piece)
+            position += len(piece)
+        return "".join(pieces)
+    
+    def close(self):
+        self.file.close()
+
+class PAK_CRYPT_stream:
+    """ File-like view of the decrypted archive with its own position. """
+    def __init__(self, reader):
+        self.reader = reader
+        self.position = 0
+    
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.reader.real_size - self.position
+        data = self.reader.read_at(self.position, size)
+        self.position += len(data)
+        return data
+    
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += self.reader.real_size
+        self.position = offset
+    
+    def tell(self):
+        return self.position
+    
+    def close(self):
+        pass
+
+class PAK_CRYPT_cache:
+    """ Directory of decrypted archives, named after the hash and size of the encrypted file.
+    
+    Once an archive is in the cache it is read like a plain pak file. The least recently used 
+    archives are removed when the cache grows over max_size bytes.
+    """
+    extension = ".pak"
+    
+    def __init__(self, cache_dir, max_size=PAK_CRYPT_CACHE_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+    
+    def get_key(self, filepath):
+        sha1 = hashlib.sha1()
+        size = 0
+        with open(filepath, "rb") as f:
+            while True:
+                data = f.read(PAK_CHUNK_SIZE)
+                if not data:
+                    break
+                sha1.update(data)
+                size += len(data)
+        return "%s_%i" % (sha1.hexdigest(), size)
+    
+    def get_plain_filepath(self, filepath, reader):
+        """ Return the decrypted archive, decrypting it into the cache first if needed. """
+        plain_filepath = os.path.join(self.cache_dir, self.get_key(filepath) + self.extension)
+        if os.path.exists(plain_filepath):
+            # mark as recently used
+            os.utime(plain_filepath, None)
+            return plain_filepath
+        
+        temp_filepath = "%s.%i.tmp" % (plain_filepath, os.getpid())
+        with open(temp_filepath, "wb") as f:
+            for position in xrange(0, reader.real_size, PAK_CHUNK_SIZE):
+                f.write(reader.read_at(position, PAK_CHUNK_SIZE))
+        if os.path.exists(plain_filepath):
+            # another process got there first
+            os.remove(temp_filepath)
+        else:
+            os.rename(temp_filepath, plain_filepath)
+        self.evict(keep=plain_filepath)
+        return plain_filepath
+    
+    def evict(self, keep=None):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(self.extension):
+                path = os.path.join(self.cache_dir, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                total_size -= size
+            except OSError:
+                # still open by someone else on Windows
+                pass
 
 class PAK_CRYPT_file(PAK_file):
+    def __init__(self, filepath=None, cache=None):
+        """ cache is an optional PAK_CRYPT_cache, the archive is then decrypted at most once. """
+        self.cache = cache
+        PAK_file.__init__(self, filepath)
+        
     def open(self, filepath=None, peek=False):        
         if filepath == None and self.filepath == None:
             print "File path is empty"
@@ -161,26 +831,696 @@ class PAK_CRYPT_file(PAK_file):
         if self.filepath == None:
             self.filepath = filepath
         
+        self.reader = PAK_CRYPT_reader(self.filepath)
+        if self.cache is not None:
+            self.plain_filepath = self.cache.get_plain_filepath(self.filepath, self.reader)
+        self.io = self.open_plain()
+        self.header = PAK_header()
+
+    def dump(self, dest_filepath=os.getcwd(), verbose=False, session=None):          
+        if session is None:
+            session = PAK_session([print_progress])
+        decrypt_time = self.get_decrypt_time()
+        self.header.unpack(self.io, dest_filepath, verbose, session)
+        session.add_time("decrypt", self.get_decrypt_time() - decrypt_time)
+        return session
+    
+    def open_plain(self):
+        if self.plain_filepath is not None:
+            return PAK_file.open_plain(self)
+        return PAK_CRYPT_stream(self.reader)
+    
+    def get_view(self, offset, size):
+        if self.plain_filepath is not None:
+            return PAK_file.get_view(self, offset, size)
+        return self.reader.read_at(offset, size)
+    
+    def open_member(self, path):
+        """ Return a file-like object over the member data, only the parts that are read are decrypted. """
+        if self.plain_filepath is not None:
+            return PAK_file.open_member(self, path)
+        offset, size, _ = self.get_index().find(path)
+        return PAK_member(path, PAK_range(self, offset, size))
+    
+    def copy_member(self, offset, size, out_file, chunk_size=PAK_CHUNK_SIZE, timings=None):
+        if self.plain_filepath is not None:
+            return PAK_file.copy_member(self, offset, size, out_file, chunk_size, timings)
+        start = time.time()
+        for position in xrange(0, size, chunk_size):
+            decrypted = get_thread_decrypt_time()
+            data = self.get_view(offset + position, min(chunk_size, size - position))
+            start = add_read_time(timings, start, decrypted)
+            out_file.write(data)
+            start = add_time(timings, "write", start)
+    
+    def get_decrypt_time(self):
+        return self.reader.decrypt_time
+    
+    def close(self):
+        PAK_file.close(self)
+        self.io.close()
+        self.reader.close()
+
+def extract_batch(pak_file, dest_filepath, batch, chunk_size=PAK_CHUNK_SIZE):
+    """ Write a list of (path, offset, size) members, returns (number of files, number of bytes, timings). """
+    num_bytes = 0
+    timings = {}
+    for path, offset, size in batch:
+        with open(os.path.join(dest_filepath, path), "wb") as f:
+            pak_file.copy_member(offset, size, f, chunk_size, timings)
+        num_bytes += size
+    return len(batch), num_bytes, timings
+
+def extract_runs(pak_file, dest_filepath, runs, chunk_size=PAK_CHUNK_SIZE):
+    """ Write a list of (start, end, members) runs, each run is read from the archive at once. 
+    
+    A run of a single member larger than chunk_size is streamed instead.
+    """
+    num_files = 0
+    num_bytes = 0
+    timings = {}
+    with closing(pak_file.open_plain()) as archive:
+        readahead(archive, 0, 0, POSIX_FADV_SEQUENTIAL)
+        for i, (start, end, members) in enumerate(runs):
+            if i + 1 < len(runs):
+                readahead(archive, runs[i + 1][0], runs[i + 1][1] - runs[i + 1][0])
+            if len(members) == 1 and end - start > chunk_size:
+                path, offset, size = members[0]
+                with open(os.path.join(dest_filepath, path), "wb") as f:
+                    copy_range(archive, offset, size, f, chunk_size, timings)
+                num_bytes += size
+                num_files += 1
+                continue
+            read_start = time.time()
+            decrypted = get_thread_decrypt_time()
+            archive.seek(start)
+            data = archive.read(end - start)
+            write_start = add_read_time(timings, read_start, decrypted)
+            for path, offset, size in members:
+                with open(os.path.join(dest_filepath, path), "wb") as f:
+                    f.write(buffer(data, offset - start, size))
+                num_bytes += size
+            add_time(timings, "write", write_start)
+            num_files += len(members)
+    return num_files, num_bytes, timings
+
+extract_worker_pak = None
+
+def init_extract_worker(pak_class, filepath):
+    global extract_worker_pak
+    extract_worker_pak = pak_class(filepath)
+
+def extract_batch_worker(args):
+    batch_id, dest_filepath, batch, sequential, chunk_size = args
+    decrypt_time = extract_worker_pak.get_decrypt_time()
+    if sequential:
+        num_files, num_bytes, timings = extract_runs(extract_worker_pak, dest_filepath, batch, chunk_size)
+    else:
+        num_files, num_bytes, timings = extract_batch(extract_worker_pak, dest_filepath, batch, chunk_size)
+    # every worker process has its own archive, so its decryption time is reported with the batch
+    timings["decrypt"] = extract_worker_pak.get_decrypt_time() - decrypt_time
+    return batch_id, (num_files, num_bytes, timings)
+
+class PAK_manifest:
+    """ Record of the members extracted into a directory.
+    
+    Each line holds path, size, crc, source archive and the modification time of the extracted file,
+    separated by tabs. A member is only extracted again if one of them changed.
+    """
+    file_name = "pak_manifest.txt"
+    
+    def __init__(self, dest_filepath):
+        self.dest_filepath = dest_filepath
+        self.filepath = os.path.join(dest_filepath, self.file_name)
+        self.entries = {}   # {path : (size, crc, archive, mtime)} mapping
+        if os.path.exists(self.filepath):
+            self.load()
+    
+    def load(self):
         with open(self.filepath, "rb") as f:
-            _, real_size, block_size = struct.unpack("<HII", f.read(0xa))
-        
-            buf = f.read(block_size)
+            for line in f:
+                path, size, crc, archive, mtime = line.rstrip("\r\n").split("\t")
+                self.entries[path] = (int(size), int(crc), archive, float(mtime))
+    
+    def save(self):
+        temp_filepath = self.filepath + ".tmp"
+        with open(temp_filepath, "wb") as f:
+            for path in sorted(self.entries):
+                size, crc, archive, mtime = self.entries[path]
+                f.write("%s\t%i\t%i\t%s\t%r\n" % (path, size, crc, archive, mtime))
+        if os.path.exists(self.filepath):
+            os.remove(self.filepath)
+        os.rename(temp_filepath, self.filepath)
+    
+    def is_current(self, path, size, crc, archive):
+        entry = self.entries.get(path)
+        if entry is None or entry[:3] != (size, crc, archive):
+            return False
+        try:
+            stat = os.stat(os.path.join(self.dest_filepath, path))
+        except OSError:
+            return False
+        # the file was edited or replaced after it was extracted
+        return stat.st_size == size and stat.st_mtime == entry[3]
+    
+    def update(self, path, size, crc, archive):
+        mtime = os.stat(os.path.join(self.dest_filepath, path)).st_mtime
+        self.entries[path] = (size, crc, archive, mtime)
+
+def print_progress(event, session):
+    """ PAK_session listener that prints the percentage of bytes extracted. """
+    if event == "progress" and session.total_bytes > 0:
+        sys.stdout.write("%.0f%%\r" % session.get_percent())
+
+class PAK_session:
+    """ Counters, timings and progress events of one extraction.
+    
+    Listeners are called as listener(event, session) with the events "start", "progress" and "finish".
+    Time is kept per phase: parsing the descriptor, decrypting, reading and writing. With several 
+    workers the phases add up the time of every worker, so they can be longer than the wall time.
+    """
+    phases = ("descriptor", "decrypt", "read", "write")
+    
+    def __init__(self, listeners=None):
+        self.listeners = list(listeners) if listeners is not None else []
+        self.lock = threading.Lock()
+        self.timings = dict((phase, 0.0) for phase in self.phases)  # {phase : seconds} mapping
+        self.total_files = 0
+        self.total_bytes = 0
+        self.files_done = 0
+        self.bytes_done = 0
+        self.files_skipped = 0
+        self.start_time = None
+        self.end_time = None
+    
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+    
+    def notify(self, event):
+        for listener in self.listeners:
+            listener(event, self)
+    
+    @contextmanager
+    def timer(self, phase):
+        """ Add the time spent in a with block to phase. """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.time() - start)
+    
+    def add_time(self, phase, seconds):
+        with self.lock:
+            self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+    
+    def start(self, total_files, total_bytes):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.start_time = time.time()
+        self.end_time = None
+        self.notify("start")
+    
+    def progress(self, num_files, num_bytes, timings=None):
+        with self.lock:
+            self.files_done += num_files
+            self.bytes_done += num_bytes
+            for phase, seconds in (timings or {}).iteritems():
+                self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+        self.notify("progress")
+    
+    def finish(self):
+        self.end_time = time.time()
+        self.notify("finish")
+    
+    def get_elapsed(self):
+        """ Wall time since start in seconds. """
+        if self.start_time is None:
+            return 0.0
+        end_time = self.end_time if self.end_time is not None else time.time()
+        return end_time - self.start_time
+    
+    def get_bytes_per_second(self):
+        elapsed = self.get_elapsed()
+        return self.bytes_done / elapsed if elapsed > 0 else 0.0
+    
+    def get_files_per_second(self):
+        elapsed = self.get_elapsed()
+        return self.files_done / elapsed if elapsed > 0 else 0.0
+    
+    def get_percent(self):
+        if self.total_bytes == 0:
+            return 100.0
+        return self.bytes_done * 100.0 / self.total_bytes
+    
+    def get_eta(self):
+        """ Estimated seconds left at the current rate, None until something was extracted. """
+        bytes_per_second = self.get_bytes_per_second()
+        if bytes_per_second == 0:
+            return None
+        return (self.total_bytes - self.bytes_done) / bytes_per_second
+    
+    def get_summary(self):
+        summary = "%i files, %i bytes in %.2f s, %.2f MB/s, %.1f files/s" % \
+            (self.files_done, self.bytes_done, self.get_elapsed(), self.get_bytes_per_second() / (1024 * 1024), 
+             self.get_files_per_second())
+        if self.files_skipped > 0:
+            summary += ", %i unchanged files skipped" % self.files_skipped
+        timings = ", ".join("%s %.2f s" % (phase, self.timings[phase]) for phase in self.phases)
+        return "%s\nTimings: %s" % (summary, timings)
 
-            CIPHER = ""
-            if os.path.splitext(os.path.basename(self.filepath))[0] == "dlc5_dlc5_configs_win32.pak":
-                CIPHER = "DLC5"
-            elif os.path.splitext(os.path.basename(self.filepath))[0] == "dlc6_dlc6_configs_win32.pak":
-                CIPHER = "DLC6"                
+class PAK_extractor:
+    """ Extracts every member of an archive with a pool of workers.
+    
+    Members are handed out in batches straight from the index, each worker writes its batch 
+    with positional reads of the archive and progress is only counted in the calling thread.
+    In sequential mode the members are sorted by offset and neighbours are read together, 
+    so the archive is read front to back in large requests.
+    Members larger than a chunk are always streamed, so the memory used does not depend 
+    on the size of the largest member.
+    In incremental mode a manifest in the destination directory is used to skip members 
+    that were already extracted and did not change since. When several archives are extracted 
+    into one directory, the paths that later archives override are skipped, so every file is 
+    written once, by the archive the game loads it from. Counters and timings are kept 
+    in a PAK_session.
+    """
+    batch_size = 16 * 1024 * 1024 # in bytes
+    read_size = 8 * 1024 * 1024 # largest coalesced read in bytes
+    max_gap = 64 * 1024 # largest hole between two members that is read through
+    
+    def __init__(self, pak_file, dest_filepath, jobs=1, processes=False, sequential=False, memory_limit=None, 
+                 incremental=False, member_filter=None, verbose=False, session=None, overrides=None):
+        self.pak_file = pak_file
+        self.member_filter = member_filter
+        self.overrides = overrides if overrides is not None else set()
+        self.overridden = 0
+        self.dest_filepath = dest_filepath
+        self.jobs = max(1, jobs)
+        self.processes = processes
+        self.sequential = sequential
+        self.chunk_size = PAK_CHUNK_SIZE
+        if memory_limit is not None:
+            # every worker holds at most one run or one chunk
+            worker_limit = max(memory_limit / self.jobs, 64 * 1024)
+            self.chunk_size = min(self.chunk_size, worker_limit)
+            self.read_size = min(self.read_size, worker_limit)
+        self.manifest = PAK_manifest(dest_filepath) if incremental else None
+        self.archive_name = os.path.basename(pak_file.filepath)
+        self.verbose = verbose
+        self.session = session if session is not None else PAK_session()
+    
+    def get_members(self, index):
+        members = []
+        for path, offset, size, crc in index:
+            if self.member_filter is not None and not self.member_filter.match(path):
+                continue
+            if path in self.overrides:
+                self.overridden += 1
+                continue
+            if self.manifest is not None and self.manifest.is_current(path, size, crc, self.archive_name):
+                self.session.files_skipped += 1
+                continue
+            if self.verbose:
+                print "File name: %s" % path
+                print "File offset: %s" % hex(offset).rstrip('L')
+                print "File Size: %s bytes" % hex(size).rstrip('L')
+                print "File unknown crc: %s" % hex(crc).rstrip('L')
+                print 
+            members.append((path, offset, size))
+        return members
+    
+    def get_runs(self, members):
+        """ Group members sorted by offset into (start, end, members) runs of adjacent data. """
+        runs = []
+        for path, offset, size in sorted(members, key=lambda member: member[1]):
+            if len(runs) > 0:
+                start, end, run_members = runs[-1]
+                if offset >= end and offset - end <= self.max_gap and offset + size - start <= self.read_size:
+                    run_members.append((path, offset, size))
+                    runs[-1] = (start, offset + size, run_members)
+                    continue
+            runs.append((offset, offset + size, [(path, offset, size)]))
+        return runs
+    
+    def get_batches(self, items, get_size):
+        # small archives are still split so that every worker gets something to do
+        limit = max(1, min(self.batch_size, self.session.total_bytes / (self.jobs * 4)))
+        batches = []
+        batch = []
+        batch_bytes = 0
+        for item in items:
+            batch.append(item)
+            batch_bytes += get_size(item)
+            if batch_bytes >= limit:
+                batches.append(batch)
+                batch = []
+                batch_bytes = 0
+        if len(batch) > 0:
+            batches.append(batch)
+        return batches
+    
+    def make_dirs(self, members):
+        for dir in set(posixpath.dirname(path) for path, _, _ in members):
+            path = os.path.join(self.dest_filepath, dir)
+            if not os.path.exists(path):
+                os.makedirs(path)
+    
+    def batch_done(self, index, batch):
+        if self.manifest is None:
+            return
+        if self.sequential:
+            batch = [member for _, _, members in batch for member in members]
+        for path, _, size in batch:
+            self.manifest.update(path, size, index.find(path)[2], self.archive_name)
+    
+    def run(self):
+        session = self.session
+        decrypt_time = self.pak_file.get_decrypt_time()
+        # phase one, the whole descriptor is read before any data
+        with session.timer("descriptor"):
+            index = self.pak_file.get_index()
+        members = self.get_members(index)
+        if self.overridden > 0:
+            print "Skipping %i files that later pak files override" % self.overridden
+        if session.files_skipped > 0:
+            print "Skipping %i unchanged files" % session.files_skipped
+        session.start(len(members), sum(size for _, _, size in members))
+        self.make_dirs(members)
+        
+        # phase two, the data
+        if self.sequential:
+            batches = self.get_batches(self.get_runs(members), lambda run: run[1] - run[0])
+            work = extract_runs
+        else:
+            batches = self.get_batches(members, lambda member: member[2])
+            work = extract_batch
+        
+        def work_item(item):
+            batch_id, batch = item
+            return batch_id, work(self.pak_file, self.dest_filepath, batch, self.chunk_size)
+        
+        pool = None
+        if self.jobs == 1:
+            results = (work_item(item) for item in enumerate(batches))
+        elif self.processes:
+            if self.pak_file.plain_filepath is not None:
+                worker_args = (PAK_file, self.pak_file.plain_filepath)
             else:
-                CIPHER = "JABIA_JAC"
-            
-            aes = AES.new(base64.b64decode(AES_KEY_CIPHERED[CIPHER]), AES.MODE_ECB)
-            self.io = cStringIO.StringIO(aes.decrypt(buf)[:real_size])
-        self.header = PAK_header()
+                worker_args = (self.pak_file.__class__, self.pak_file.filepath)
+            pool = multiprocessing.Pool(self.jobs, init_extract_worker, worker_args)
+            results = pool.imap_unordered(extract_batch_worker, 
+                                          [(batch_id, self.dest_filepath, batch, self.sequential, self.chunk_size) 
+                                           for batch_id, batch in enumerate(batches)])
+        else:
+            pool = ThreadPool(self.jobs)
+            results = pool.imap_unordered(work_item, enumerate(batches))
+        try:
+            for batch_id, (num_files, num_bytes, timings) in results:
+                self.batch_done(index, batches[batch_id])
+                session.progress(num_files, num_bytes, timings)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            # whatever was written so far is recorded, even if extraction was interrupted
+            if self.manifest is not None:
+                self.manifest.save()
+        # threads share the archive of this process, worker processes report their own decryption time
+        session.add_time("decrypt", self.pak_file.get_decrypt_time() - decrypt_time)
+        session.finish()
+
+class PAK_writer:
+    """ Builds a pak file from loose files or from members of other archives.
+    
+    The directory table only depends on names and sizes, so offsets are computed up front and 
+    the data is streamed into place in one pass. The crcs of loose files are only known once the data is 
+    written, the directory table is written again with them at the end. Members of other archives 
+    keep the crc they were added with.
+    The data is stored in table order, unless a layout puts groups of members that are read 
+    together first, each group starting on a page boundary.
+    """
+    write_buffer_size = 1024 * 1024 # in bytes
+    
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.dir_list = []  # directory names in table order
+        self.files = {}     # {directory name : [(file name, size, source, crc)]} mapping
+        self.layout = []    # groups of member paths whose data is stored first, in this order
+        self.page_size = None
+    
+    def add_dir(self, dir):
+        dir = dir.replace("\\", "/").strip("/")
+        if dir not in self.files:
+            self.dir_list.append(dir)
+            self.files[dir] = []
+        return dir
+    
+    def add_file(self, path, source, size=None, crc=None):
+        """ Add a member, source is a file path or a (PAK_file, offset) pair of an existing member. 
+        
+        The crc of an existing member is stored as it is, so its data does not have to be hashed 
+        again. Without one the crc is computed while the data is written.
+        """
+        if size is None:
+            size = os.path.getsize(source)
+        dir, file_name = posixpath.split(normalize_path(path))
+        self.files[self.add_dir(dir)].append((file_name, size, source, crc))
+    
+    def add_tree(self, src_filepath):
+        """ Add every file under src_filepath, paths in the archive are relative to it. """
+        for root, dirs, files in os.walk(src_filepath):
+            dirs.sort()
+            dir = os.path.relpath(root, src_filepath)
+            dir = "" if dir == os.curdir else dir
+            self.add_dir(dir)
+            for file_name in sorted(files):
+                self.add_file(posixpath.join(dir.replace(os.sep, "/"), file_name), os.path.join(root, file_name))
+    
+    def get_entries(self):
+        """ Yields (directory, file name, size, source) in table order. """
+        for dir in self.dir_list:
+            for file_name, size, source, _ in self.files[dir]:
+                yield dir, file_name, size, source
+    
+    def get_crcs(self):
+        """ Returns the crc given for each entry in table order, None where it has to be computed. """
+        return [crc for dir in self.dir_list for _, _, _, crc in self.files[dir]]
+    
+    def get_descriptor_size(self):
+        size = 24
+        for dir in self.dir_list:
+            size += 16 + len("/%s\0" % dir)
+            for file_name, _, _, _ in self.files[dir]:
+                size += 28 + len(file_name) + 1
+        return size
+    
+    def set_layout(self, groups, page_size=4096):
+        """ Store the data of the members in groups first, in the order given. 
+        
+        Every group starts on a page boundary, and so does any member that would otherwise 
+        span one page more than it needs, if the padding is smaller than the member. 
+        """
+        self.layout = groups
+        self.page_size = page_size
+    
+    def get_data_order(self):
+        """ Returns entry numbers in the order their data is stored and the set of entries that start a group. """
+        positions = {}
+        count = 0
+        for dir, file_name, _, _ in self.get_entries():
+            positions.setdefault(member_path(dir, file_name), count)
+            count += 1
+        order = []
+        group_starts = set()
+        placed = set()
+        for group in self.layout:
+            group_start = True
+            for path in group:
+                i = positions.get(normalize_path(path))
+                if i is None or i in placed:
+                    continue
+                if group_start:
+                    group_starts.add(i)
+                    group_start = False
+                order.append(i)
+                placed.add(i)
+        order.extend(i for i in xrange(count) if i not in placed)
+        return order, group_starts
+    
+    def get_offsets(self, descriptor_size):
+        """ Data is stored right after the directory table, in table order unless a layout is set. """
+        sizes = [size for _, _, size, _ in self.get_entries()]
+        offsets = [0] * len(sizes)
+        offset = descriptor_size
+        order, group_starts = self.get_data_order()
+        for i in order:
+            if self.page_size is not None:
+                padding = -offset % self.page_size
+                if i in group_starts or \
+                    (padding < sizes[i] and get_page_count(offset, sizes[i], self.page_size) > 
+                     get_page_count(offset + padding, sizes[i], self.page_size)):
+                    offset += padding
+            offsets[i] = offset
+            offset += sizes[i]
+        return offsets
+    
+    def pack_descriptor(self, descriptor_size, offsets, crcs):
+        buffers = [struct.pack(">Q", PAK_SIGNATURE), struct.pack("<QQ", descriptor_size, len(self.dir_list))]
+        i = 0
+        for dir_index, dir in enumerate(self.dir_list):
+            dir_name = "/%s\0" % dir
+            buffers.append(struct.pack("<IIQ", dir_index + 1, len(dir_name), len(self.files[dir])))
+            buffers.append(dir_name)
+            for file_name, size, _, _ in self.files[dir]:
+                file_name += "\0"
+                buffers.append(struct.pack("<IQQQ", len(file_name), size, offsets[i], crcs[i] or 0))
+                buffers.append(file_name)
+                i += 1
+        return "".join(buffers)
+    
+    def copy_data(self, source, size, out_file, crc=None):
+        """ Stream one member into out_file, returns its crc32. 
+        
+        A crc given for a member of another archive is returned as it is, loose files are 
+        always hashed.
+        """
+        if isinstance(source, tuple):
+            pak_file, offset = source
+            hashed = 0
+            for position in xrange(0, size, PAK_CHUNK_SIZE):
+                data = pak_file.get_view(offset + position, min(PAK_CHUNK_SIZE, size - position))
+                if crc is None:
+                    hashed = zlib.crc32(data, hashed)
+                out_file.write(data)
+            return hashed & 0xffffffff if crc is None else crc
+        crc = 0
+        with open(source, "rb") as f:
+            copied = 0
+            while copied < size:
+                data = f.read(min(PAK_CHUNK_SIZE, size - copied))
+                if not data:
+                    raise IOError("%s changed while it was packed" % source)
+                crc = zlib.crc32(data, crc)
+                out_file.write(data)
+                copied += len(data)
+        return crc & 0xffffffff
+    
+    def get_archive_size(self, descriptor_size, offsets):
+        end = descriptor_size
+        for i, (_, _, size, _) in enumerate(self.get_entries()):
+            end = max(end, offsets[i] + size)
+        return end
+    
+    def write_to(self, out_file, descriptor_size, offsets, verbose=False):
+        """ Write the archive to out_file, which has to support seeking back to the start. """
+        entries = list(self.get_entries())
+        total_bytes = sum(size for _, _, size, _ in entries)
+        crcs = self.get_crcs()
+        
+        out_file.write(self.pack_descriptor(descriptor_size, offsets, crcs))
+        written = 0
+        # the data is written front to back, whatever order the table has
+        for i in sorted(xrange(len(entries)), key=lambda i: offsets[i]):
+            dir, file_name, size, source = entries[i]
+            if verbose:
+                print "File name: %s" % member_path(dir, file_name)
+                print "File offset: %s" % hex(offsets[i]).rstrip('L')
+                print "File Size: %s bytes" % hex(size).rstrip('L')
+                print
+            if out_file.tell() < offsets[i]:
+                out_file.write("\0" * (offsets[i] - out_file.tell()))
+            crcs[i] = self.copy_data(source, size, out_file, crcs[i])
+            written += size
+            if total_bytes > 0:
+                sys.stdout.write("%.0f%%\r" % (written * 100.0 / total_bytes))
+        out_file.seek(0)
+        out_file.write(self.pack_descriptor(descriptor_size, offsets, crcs))
+    
+    def write(self, verbose=False):
+        print "Creating %s" % self.filepath
+        descriptor_size = self.get_descriptor_size()
+        offsets = self.get_offsets(descriptor_size)
+        with open(self.filepath, "wb", self.write_buffer_size) as f:
+            self.write_to(f, descriptor_size, offsets, verbose)
+
+class PAK_CRYPT_output:
+    """ File-like object that encrypts a plain archive as it is written into a pak.crypt file.
+    
+    The first head_size bytes are kept in memory until close, so the directory table can still 
+    be rewritten. Everything after that is encrypted and written in chunks as soon as whole 
+    AES blocks are available.
+    """
+    def __init__(self, file_pointer, real_size, cipher="JABIA_JAC", head_size=0):
+        self.file = file_pointer
+        self.real_size = real_size
+        self.block_size = real_size + (-real_size) % AES.block_size
+        self.aes = AES.new(base64.b64decode(AES_KEY_CIPHERED[cipher]), AES.MODE_ECB)
+        self.head_size = min(head_size + (-head_size) % AES.block_size, self.block_size)
+        self.head = bytearray(self.head_size)
+        self.pending = []
+        self.pending_size = 0
+        self.position = 0
+        self.end = 0
+        self.file.write(struct.pack("<HII", 0, self.real_size, self.block_size))
+        self.file.seek(PAK_CRYPT_reader.header_size + self.head_size)
+    
+    def write(self, data):
+        data = str(data)
+        if self.position < self.head_size:
+            head_data = data[:self.head_size - self.position]
+            self.head[self.position:self.position + len(head_data)] = head_data
+            self.position += len(head_data)
+            self.end = max(self.end, self.position)
+            data = data[len(head_data):]
+        if len(data) > 0:
+            if self.position != self.end:
+                raise IOError("Only the first %i bytes of a pak.crypt can be rewritten" % self.head_size)
+            self.pending.append(data)
+            self.pending_size += len(data)
+            self.position += len(data)
+            if self.pending_size >= PAK_CHUNK_SIZE:
+                self.flush_blocks()
+        self.end = max(self.end, self.position)
+    
+    def flush_blocks(self, pad=False):
+        data = "".join(self.pending)
+        if pad:
+            data += "\0" * ((-len(data)) % AES.block_size)
+        length = len(data) - len(data) % AES.block_size
+        self.file.write(self.aes.encrypt(data[:length]))
+        self.pending = [data[length:]] if length < len(data) else []
+        self.pending_size = len(data) - length
+    
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence != os.SEEK_SET or (offset > self.head_size and offset != self.end):
+            raise IOError("Only the first %i bytes of a pak.crypt can be rewritten" % self.head_size)
+        self.position = offset
+    
+    def tell(self):
+        return self.position
+    
+    def close(self):
+        if self.end != self.real_size:
+            raise IOError("Wrote %i bytes, the header promised %i bytes" % (self.end, self.real_size))
+        self.flush_blocks(pad=True)
+        self.file.seek(PAK_CRYPT_reader.header_size)
+        self.file.write(self.aes.encrypt(str(self.head)))
+
+class PAK_CRYPT_writer(PAK_writer):
+    """ Builds a pak.crypt file, the plain archive is never stored as a whole. """
+    def __init__(self, filepath, cipher="JABIA_JAC"):
+        PAK_writer.__init__(self, filepath)
+        self.cipher = cipher
+        
+    def write(self, verbose=False):
+        print "Creating %s" % self.filepath
+        descriptor_size = self.get_descriptor_size()
+        offsets = self.get_offsets(descriptor_size)
+        real_size = self.get_archive_size(descriptor_size, offsets)
+        with open(self.filepath, "wb", self.write_buffer_size) as f:
+            out_file = PAK_CRYPT_output(f, real_size, self.cipher, descriptor_size)
+            self.write_to(out_file, descriptor_size, offsets, verbose)
+            out_file.close()
 
-    def dump(self, dest_filepath=os.getcwd(), verbose=False):          
-            self.header.unpack(self.io, dest_filepath, verbose)
-                            
 if __name__ == "__main__":
     pF = PAK_file("C:\Program Files (x86)\Jagged Alliance Back in Action Demo\\voices_win32.pak")
     #pF = PAK_CRYPT_file("C:\Program Files (x86)\Jagged Alliance Back in Action Demo\\configs_win32.pak.crypt")
@@ -0,0 +1,128 @@
+"""
+Created on October 17, 2026
+"""
+"""
+    Copyright (C) 2026 JA-BiA-Tools contributors
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from pak_file import PAK_writer, PAK_CRYPT_writer, member_path, normalize_path
+
+def load_trace(filepath):
+    """ Read an access log with one member path per line, in the order the files are read.
+    
+    Blank lines and lines starting with # separate groups of files that are loaded together,
+    such as one level or screen. Returns the groups as lists of paths.
+    """
+    groups = [[]]
+    with open(filepath, "rb") as f:
+        for line in f:
+            line = line.strip()
+            if line == "" or line.startswith("#"):
+                if len(groups[-1]) > 0:
+                    groups.append([])
+                continue
+            groups[-1].append(normalize_path(line))
+    return [group for group in groups if len(group) > 0]
+
+def simulate(accesses, page_size=4096, readahead_size=128 * 1024):
+    """ Replay a list of (offset, size) reads against a cold page cache.
+    
+    A read that does not start within the readahead window behind the previous read is counted
+    as a seek, a read of pages that were all read before is free. Returns a dict with the number
+    of seeks, the bytes seeked over, the pages and the readahead windows touched.
+    """
+    seeks = 0
+    seek_bytes = 0
+    pages = set()
+    windows = set()
+    end = None
+    for offset, size in accesses:
+        if size == 0:
+            continue
+        read_pages = set(xrange(offset / page_size, (offset + size - 1) / page_size + 1))
+        if read_pages <= pages:
+            # read again, still in the page cache
+            continue
+        if end is None or offset < end or offset >= end + readahead_size:
+            seeks += 1
+            if end is not None:
+                seek_bytes += abs(offset - end)
+        pages.update(read_pages)
+        windows.update(xrange(offset / readahead_size, (offset + size - 1) / readahead_size + 1))
+        end = offset + size
+    return {"seeks" : seeks, "seek_bytes" : seek_bytes, "pages" : len(pages), "readahead" : len(windows)}
+
+class PAK_layout:
+    """ Repacks an archive so that the members of an access trace are stored in the order they are read.
+    
+    The directory table keeps its order, only the data moves. Each group of the trace starts
+    on a page boundary, members that are not in the trace follow in table order.
+    """
+    def __init__(self, pak_file, groups, page_size=4096, readahead_size=128 * 1024):
+        self.pak_file = pak_file
+        self.groups = groups
+        self.page_size = page_size
+        self.readahead_size = readahead_size
+        self.index = pak_file.get_index()
+        self.missing = sorted(set(path for group in groups for path in group if path not in self.index))
+    
+    def get_writer(self, filepath, cipher=None):
+        if cipher is not None:
+            pak_writer = PAK_CRYPT_writer(filepath, cipher)
+        else:
+            pak_writer = PAK_writer(filepath)
+        # every directory keeps its place in the table, even an empty one
+        for dir in self.index.dir_list:
+            pak_writer.add_dir(dir)
+        for path, offset, size, crc in self.index:
+            pak_writer.add_file(path, (self.pak_file, offset), size, crc)
+        pak_writer.set_layout(self.groups, self.page_size)
+        return pak_writer
+    
+    def get_accesses(self, lookup):
+        """ Returns the (offset, size) reads of the trace, lookup maps a path to (offset, size). """
+        return [lookup[path] for group in self.groups for path in group if path in lookup]
+    
+    def get_report(self, pak_writer):
+        """ Returns (statistics of the current layout, statistics of the new layout, padding in bytes). """
+        old_lookup = dict((path, (offset, size)) for path, offset, size, _ in self.index)
+        descriptor_size = pak_writer.get_descriptor_size()
+        offsets = pak_writer.get_offsets(descriptor_size)
+        new_lookup = {}
+        for i, (dir, file_name, size, _) in enumerate(pak_writer.get_entries()):
+            new_lookup[member_path(dir, file_name)] = (offsets[i], size)
+        old = simulate(self.get_accesses(old_lookup), self.page_size, self.readahead_size)
+        new = simulate(self.get_accesses(new_lookup), self.page_size, self.readahead_size)
+        padding = pak_writer.get_archive_size(descriptor_size, offsets) - descriptor_size - \
+            self.index.get_content_size()
+        return old, new, padding
+    
+    def print_report(self, pak_writer):
+        old, new, padding = self.get_report(pak_writer)
+        print "Trace: %i groups, %i files" % (len(self.groups), sum(len(group) for group in self.groups))
+        if len(self.missing) > 0:
+            print "%i files of the trace are not in the archive" % len(self.missing)
+        for key, name in (("seeks", "Seeks"), ("seek_bytes", "Bytes seeked over"), ("pages", "Pages read"),
+                          ("readahead", "Readahead windows read")):
+            saved = old[key] - new[key]
+            percent = saved * 100.0 / old[key] if old[key] > 0 else 0.0
+            print "%s: %i -> %i (%.1f%% saved)" % (name, old[key], new[key], percent)
+        print "Padding added: %i bytes" % padding
+    
+    def write(self, filepath, cipher=None, verbose=False):
+        pak_writer = self.get_writer(filepath, cipher)
+        pak_writer.write(verbose)
+        return pak_writer
@@ -21,47 +21,313 @@ Created on February 2, 2012
 """
 
 import argparse
+import multiprocessing
 import os
-from pak_file import PAK_file, PAK_CRYPT_file
+import sys
+import socket
+import zipfile
+from contextlib import closing
+from pak_file import PAK_file, PAK_CRYPT_file, PAK_CRYPT_cache, PAK_writer, PAK_CRYPT_writer, PAK_filter, PAK_session, \
+    AES_KEY_CIPHERED, print_progress
+from pak_store import PAK_store
+from pak_diff import PAK_diff
+from pak_vfs import PAK_vfs, open_archive
+from pak_server import PAK_server
+from pak_verify import PAK_verifier, CHECKSUMS
+from pak_layout import PAK_layout, load_trace
+from pak_catalog import PAK_catalog
+from pak_stream import stream_tar, stream_zip
 
-parser = argparse.ArgumentParser(description='Tool that can unpack Jagged Alliance: BiA pak/pak.crypt files.')
+def open_output(destination):
+    """ Open - as standard output, tcp:HOST:PORT as a connection and anything else as a file, for writing. """
+    if destination == "-":
+        if sys.platform == "win32":
+            import msvcrt
+            msvcrt.setmode(sys.stdout.fileno(), os.O_BINARY)
+        return os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    if destination.startswith("tcp:"):
+        host, port = destination[4:].rsplit(":", 1)
+        connection = socket.create_connection((host, int(port)))
+        output = connection.makefile("wb", 1024 * 1024)
+        connection.close()  # the file object keeps the socket open
+        return output
+    return open(destination, "wb")
 
-parser.add_argument('file', nargs='?', help='Input file')
-parser.add_argument('outdir', nargs='?', help='Output directory')
-parser.add_argument('-i', '--info', default=False, action='store_true', help='Output information about pak file')
-parser.add_argument('-d', '--debug', default=False, action='store_true', help='Show debug messages.')
+def print_progress_line(event, session):
+    """ Machine readable progress for front ends such as the wizard, one line per event:
+    event, files done, files total, bytes done, bytes total, bytes/s, files/s and ETA in seconds (-1 if unknown).
+    """
+    eta = session.get_eta()
+    print "PROGRESS %s %i %i %i %i %.0f %.1f %.1f" % (event, session.files_done, session.total_files, session.bytes_done, 
+                                                    session.total_bytes, session.get_bytes_per_second(), 
+                                                    session.get_files_per_second(), eta if eta is not None else -1)
+    sys.stdout.flush()
 
+# worker processes import this module, so only the main process may parse arguments
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    
+    parser = argparse.ArgumentParser(description='Tool that can unpack Jagged Alliance: BiA pak/pak.crypt files.', 
+                                     epilog='If the input is a directory it is packed into a pak file instead, ' + \
+                                     'or into an encrypted pak.crypt file if the output name ends with .crypt. ' + \
+                                     '"serve PATH" serves a pak file, or every pak file of an install directory, over HTTP.')
+
+    parser.add_argument('file', nargs='?', help='Input file, or directory to pack')
+    parser.add_argument('outdir', nargs='?', help='Output directory, or output pak file when packing')
+    parser.add_argument('-i', '--info', default=False, action='store_true', help='Output information about pak file')
+    parser.add_argument('-l', '--list', default=False, action='store_true', help='List the files in the pak file')
+    parser.add_argument('-s', '--sidecar', nargs='?', const=True, default=None, metavar='DIR',
+                        help='Cache the table of contents of every pak file in a sidecar index file, ' + \
+                        'kept in DIR or next to the pak file by default')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of files to extract in parallel')
+    parser.add_argument('-p', '--processes', default=False, action='store_true', 
+                        help='Extract with a pool of processes instead of threads')
+    parser.add_argument('-S', '--sequential', default=False, action='store_true', 
+                        help='Read the pak file front to back in large reads, best for hard disks and network shares')
+    parser.add_argument('-m', '--memory', type=int, default=None, metavar='MB',
+                        help='Largest amount of file data held in memory while extracting, in MB')
+    parser.add_argument('-u', '--update', default=False, action='store_true',
+                        help='Only extract files that are new or changed since the last extraction into the output directory')
+    parser.add_argument('--overridden-by', nargs='+', default=[], metavar='PAK', 
+                        help='Pak files loaded after this one, the files they contain are not extracted')
+    parser.add_argument('-c', '--cache', default=None, metavar='DIR',
+                        help='Keep decrypted pak.crypt files in this directory, so they are only decrypted once')
+    parser.add_argument('--cache-size', type=int, default=1024, metavar='MB', 
+                        help='Largest size of the decrypted pak.crypt cache, in MB')
+    parser.add_argument('--cipher', default='JABIA_JAC', choices=sorted(AES_KEY_CIPHERED.keys()),
+                        help='Key used to encrypt a packed pak.crypt file')
+    parser.add_argument('--include', action='append', default=[], metavar='PATTERN',
+                        help='Only list or extract files matching this glob, for example *.ctx or configs/*.txt. Can be repeated')
+    parser.add_argument('--exclude', action='append', default=[], metavar='PATTERN',
+                        help='Skip files matching this glob. Can be repeated')
+    parser.add_argument('--regex', default=False, action='store_true', 
+                        help='Treat include and exclude patterns as regular expressions')
+    parser.add_argument('--store', default=None, metavar='DIR',
+                        help='Extract into a content-addressed store shared by all game versions, ' + \
+                        'the output directory is then filled with hard links to it')
+    parser.add_argument('--version', default=None, 
+                        help='Game version the files are stored for, the name of the output directory by default')
+    parser.add_argument('--diff', default=None, metavar='OLD',
+                        help='List the files that were added (A), changed (M) or removed (D) since the OLD pak file, ' + \
+                        'and write the added and changed files into the output pak file if one is given')
+    parser.add_argument('--confirm', default=False, action='store_true',
+                        help='With --diff, also compare the data of files whose size and crc did not change')
+    parser.add_argument('-t', '--tar', default=False, action='store_true',
+                        help='Write the files as a tar stream instead of extracting them. The output is a file, ' + \
+                        '- for standard output or tcp:HOST:PORT')
+    parser.add_argument('-z', '--zip', default=False, action='store_true',
+                        help='Write the files as a zip stream instead of extracting them, the output is the same as for --tar')
+    parser.add_argument('--deflate', default=False, action='store_true', help='Compress the files in a zip stream')
+    parser.add_argument('--verify', nargs='?', const='auto', default=None, choices=['auto'] + CHECKSUMS.keys(),
+                        help='Check every file against the crc in the pak file, finding out which checksum it is ' + \
+                        'unless one is given. Uses --jobs worker processes')
+    parser.add_argument('--layout', default=None, metavar='TRACE',
+                        help='Report how well the pak file fits an access log with one file path per line, and ' + \
+                        'repack it into the output pak file with the files stored in the order they are read')
+    parser.add_argument('--page-size', type=int, default=4096, help='Page boundary used by --layout, in bytes')
+    parser.add_argument('--catalog', default=None, metavar='DB',
+                        help='Add the file lists of a pak file, or of every pak file of an install directory, to a ' + \
+                        'SQLite catalog. Only pak files that changed since the last run are read again')
+    parser.add_argument('--query', default=None, metavar='SQL', 
+                        help='Run a query on the catalog, for example "SELECT path, size FROM Member ' + \
+                        'WHERE extension = \'dds\' ORDER BY size DESC LIMIT 10"')
+    parser.add_argument('--bind', default='127.0.0.1', help='Address the serve mode listens on')
+    parser.add_argument('--port', type=int, default=8080, help='Port the serve mode listens on')
+    parser.add_argument('--progress', default=False, action='store_true', 
+                        help='Print progress as one PROGRESS line per update instead of a percentage')
+    parser.add_argument('-d', '--debug', default=False, action='store_true', help='Show debug messages.')
 
-args = parser.parse_args()
-file = args.file
-outdir = args.outdir
-info = args.info
-debug = args.debug
 
-if file != None and info != False:
-    info_filepath = os.path.abspath(file)
-    print "Not implemented yet."
+    args = parser.parse_args()
+    file = args.file
+    outdir = args.outdir
+    info = args.info
+    list_files = args.list
+    sidecar = args.sidecar
+    if sidecar not in (None, True):
+        sidecar = os.path.abspath(sidecar)
+        if os.path.exists(sidecar) and not os.path.isdir(sidecar):
+            parser.error("--sidecar takes a directory, %s is a file" % args.sidecar)
+        if not os.path.exists(sidecar):
+            os.makedirs(sidecar)
+    jobs = args.jobs
+    processes = args.processes
+    sequential = args.sequential
+    incremental = args.update
+    memory_limit = args.memory * 1024 * 1024 if args.memory != None else None
+    cache = PAK_CRYPT_cache(os.path.abspath(args.cache), args.cache_size * 1024 * 1024) if args.cache != None else None
+    member_filter = None
+    if len(args.include) > 0 or len(args.exclude) > 0:
+        member_filter = PAK_filter(args.include, args.exclude, args.regex)
+    debug = args.debug
+
+    pak_file = None
+    if args.catalog != None:
+        catalog = PAK_catalog(os.path.abspath(args.catalog))
+        if file != None:
+            if os.path.isdir(file):
+                indexed, removed = catalog.refresh_install(os.path.abspath(file), sidecar, cache, debug)
+            else:
+                indexed, removed = catalog.refresh([file], sidecar, cache, debug, os.path.abspath(file))
+            print "%i pak files indexed, %i removed" % (indexed, removed)
+        if args.query != None:
+            for row in catalog.query(args.query):
+                print "\t".join(unicode(value).encode("utf-8") for value in row)
+        catalog.close()
         
-elif file != None:      
-    extension = os.path.splitext(file)[1][1:].strip()
-    pak_filepath = os.path.abspath(file)
-    
-    print "Unpacking %s" % pak_filepath
-    
-    if extension == "pak":
-        pak_file = PAK_file(filepath=pak_filepath)
-    elif extension == "crypt":
-        pak_file = PAK_CRYPT_file(filepath=pak_filepath)
-    else:
-        print "File not pak or pak.crypt" 
+    elif file == "serve" and outdir != None:
+        serve_path = os.path.abspath(outdir)
+        if os.path.isdir(serve_path):
+            vfs = PAK_vfs.from_install(serve_path, sidecar, cache)
+        else:
+            vfs = PAK_vfs([serve_path], sidecar, cache)
+        server = PAK_server(vfs, (args.bind, args.port), debug)
+        print "Serving %s on http://%s:%i/" % (serve_path, args.bind, args.port)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        server.server_close()
+        vfs.close()
+        
+    elif file != None and os.path.isdir(file):
+        src_filepath = os.path.abspath(file)
+        if outdir != None:
+            pak_filepath = os.path.abspath(outdir)
+        else:
+            pak_filepath = src_filepath.rstrip(os.sep) + ".pak"
+        print "Packing %s" % src_filepath
+        if os.path.splitext(pak_filepath)[1][1:].strip() == "crypt":
+            pak_writer = PAK_CRYPT_writer(pak_filepath, args.cipher)
+        else:
+            pak_writer = PAK_writer(pak_filepath)
+        pak_writer.add_tree(src_filepath)
+        pak_writer.write(debug)
+        
+    elif file != None:
+        extension = os.path.splitext(file)[1][1:].strip()
+        pak_filepath = os.path.abspath(file)
+        if extension == "pak":
+            pak_file = PAK_file(filepath=pak_filepath)
+        elif extension == "crypt":
+            pak_file = PAK_CRYPT_file(filepath=pak_filepath, cache=cache)
+        else:
+            print "File not pak or pak.crypt" 
+
+    if pak_file != None and (info or list_files):
+        index = pak_file.get_index(sidecar)
+        if info:
+            print "File: %s" % pak_filepath
+            print "Descriptor size: %i bytes" % index.descriptor_size
+            print "Content size: %i bytes" % index.get_content_size()
+            print "Number of directories in archive: %i" % len(index.dir_list)
+            print "Number of files in archive: %i" % len(index)
+        if list_files:
+            for path, offset, size, crc in index:
+                if member_filter != None and not member_filter.match(path):
+                    continue
+                if debug:
+                    print "%s %12i %s %s" % (hex(offset).rstrip('L'), size, hex(crc).rstrip('L'), path)
+                else:
+                    print "%12i %s" % (size, path)
+        
+    elif pak_file != None and args.verify != None:
+        print "Verifying %s" % pak_filepath
+        algorithm = args.verify if args.verify != "auto" else None
+        verifier = PAK_verifier(pak_file, algorithm, jobs, member_filter, PAK_session([print_progress]))
+        failed = verifier.run()
+        if algorithm == None:
+            for name in CHECKSUMS:
+                if debug or verifier.matches[name] > 0:
+                    print "%s matched %i of %i sampled files" % (name, verifier.matches[name], verifier.sampled)
+        if failed == None:
+            print "No known checksum matches the crc of the sampled files"
+        else:
+            print "Checksum: %s" % verifier.algorithm
+            for path, crc, value in sorted(failed):
+                print "FAILED %s (crc %s, data %s)" % (path, hex(crc).rstrip('L'), hex(value).rstrip('L'))
+            print "Verified %s" % verifier.session.get_summary()
+            print "%i files failed" % len(failed)
+        
+    elif pak_file != None and args.layout != None:
+        layout = PAK_layout(pak_file, load_trace(args.layout), args.page_size)
+        layout_filepath = os.path.abspath(outdir) if outdir != None else pak_filepath
+        cipher = args.cipher if os.path.splitext(layout_filepath)[1][1:].strip() == "crypt" else None
+        layout.print_report(layout.get_writer(layout_filepath, cipher))
+        if outdir != None:
+            layout.write(layout_filepath, cipher, debug)
+        
+    elif pak_file != None and (args.tar or args.zip):
+        # standard output may be the stream, so nothing else is printed there
+        session = PAK_session()
+        with closing(open_output(outdir if outdir != None else "-")) as output:
+            if args.tar:
+                stream_tar(pak_file, output, member_filter, session)
+            else:
+                compression = zipfile.ZIP_DEFLATED if args.deflate else zipfile.ZIP_STORED
+                stream_zip(pak_file, output, member_filter, compression, session)
+        if debug:
+            sys.stderr.write("Streamed %s\n" % session.get_summary())
+        
+    elif pak_file != None and args.diff != None:
+        old_pak_file = open_archive(os.path.abspath(args.diff), cache)
+        diff = PAK_diff(old_pak_file, pak_file, member_filter, args.confirm)
+        diff.dump()
+        print "%i added, %i changed, %i removed, %i unchanged, %i bytes compared" % \
+            (len(diff.added), len(diff.changed), len(diff.removed), diff.unchanged, diff.compared_bytes)
+        if outdir != None and not diff.is_empty():
+            patch_filepath = os.path.abspath(outdir)
+            cipher = args.cipher if os.path.splitext(patch_filepath)[1][1:].strip() == "crypt" else None
+            diff.write_patch(patch_filepath, cipher, debug)
+        old_pak_file.close()
+        
+    elif pak_file != None and args.store != None:
+        version = args.version
+        if version == None and outdir != None:
+            version = os.path.basename(os.path.abspath(outdir))
+        if version == None:
+            print "Storing needs a version or an output directory"
+        else:
+            print "Storing %s as version %s" % (pak_filepath, version)
+            store = PAK_store(os.path.abspath(args.store))
+            session = PAK_session([print_progress_line if args.progress else print_progress])
+            with session.timer("descriptor"):
+                pak_file.get_index(sidecar)
+            new_objects, new_bytes = store.add_archive(pak_file, version, member_filter, session, debug)
+            print "Stored %s" % session.get_summary()
+            print "%i new objects, %i bytes written" % (new_objects, new_bytes)
+            if outdir != None:
+                store.materialize(version, os.path.abspath(outdir))
+        
+    elif pak_file != None:      
+        print "Unpacking %s" % pak_filepath
+        session = PAK_session([print_progress_line if args.progress else print_progress])
+        with session.timer("descriptor"):
+            pak_file.get_index(sidecar)
     
-    if outdir != None:
-        output_filepath = os.path.abspath(outdir)
-        pak_file.dump(outdir, debug)
-    else:
-        pak_file.dump(verbose=debug)
+        overrides = None
+        later_list = []
+        for filepath in args.overridden_by:
+            if os.path.exists(filepath):
+                later_list.append(os.path.abspath(filepath))
+            else:
+                print "Skipping %s, the file does not exist" % filepath
+        if len(later_list) > 0:
+            # only the directory tables of the later pak files are read
+            later = PAK_vfs(later_list, sidecar, cache)
+            overrides = set(later.get_lookup())
+            later.close()
+        if outdir != None:
+            output_filepath = os.path.abspath(outdir)
+            pak_file.extract(outdir, jobs, processes, sequential, memory_limit, incremental, member_filter, debug, 
+                             session, overrides)
+        else:
+            pak_file.extract(jobs=jobs, processes=processes, sequential=sequential, memory_limit=memory_limit, 
+                             incremental=incremental, member_filter=member_filter, verbose=debug, session=session, 
+                             overrides=overrides)
+        print "Extracted %s" % session.get_summary()
             
-else:
-    print "Nothing happened"
-    parser.print_help()
+    elif file == None and args.catalog == None:
+        print "Nothing happened"
+        parser.print_help()
         
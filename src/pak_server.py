@@ -0,0 +1,145 @@
+"""
+Created on October 17, 2026
+"""
+"""
+    Copyright (C) 2026 JA-BiA-Tools contributors
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import re
+import socket
+import urllib
+import mimetypes
+import BaseHTTPServer
+import SocketServer
+from pak_vfs import PAK_vfs
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+def parse_range(header, size):
+    """ Return (start, end) of a single byte range, end excluded, None to send the whole member
+    or False if the range can not be satisfied. Several ranges are answered with the whole member.
+    """
+    match = RANGE_PATTERN.match(header.replace(" ", ""))
+    if match is None:
+        return None
+    first, last = match.groups()
+    if first == "" and last == "":
+        return None
+    if first == "":
+        # the last bytes of the member
+        length = int(last)
+        if length == 0:
+            return False
+        return max(0, size - length), size
+    start = int(first)
+    end = size if last == "" else min(int(last) + 1, size)
+    if start >= size or end <= start:
+        return False
+    return start, end
+
+class PAK_request_handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Serves members of the archives of a PAK_vfs, directories are answered with a plain text listing.
+    
+    Member data is copied straight from the archive to the socket with positional reads, through the
+    kernel for plain archives where possible. Connections are kept alive between requests.
+    """
+    protocol_version = "HTTP/1.1"
+    server_version = "pak_magick/1.0"
+    
+    def do_GET(self):
+        self.send_member(True)
+    
+    def do_HEAD(self):
+        self.send_member(False)
+    
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+    
+    def send_text(self, code, text, send_body=True):
+        self.send_response(code)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(text)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(text)
+    
+    def send_member(self, send_body):
+        vfs = self.server.vfs
+        path = urllib.unquote(self.path.split("?", 1)[0]).lstrip("/")
+        if vfs.isdir(path):
+            names = vfs.listdir(path)
+            dir = path.rstrip("/")
+            listing = "".join(name + ("/" if vfs.isdir(dir + "/" + name if dir else name) else "") + "\n"
+                              for name in names)
+            self.send_text(200, listing, send_body)
+            return
+        try:
+            pak_file, offset, size, crc = vfs.find(path)
+        except KeyError:
+            self.send_text(404, "%s not found\n" % path, send_body)
+            return
+        
+        etag = '"%08x-%x"' % (crc, offset)
+        if self.headers.get("If-None-Match") in (etag, "*"):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        
+        byte_range = None
+        if "Range" in self.headers and self.headers.get("If-Range", etag) == etag:
+            byte_range = parse_range(self.headers["Range"], size)
+        if byte_range is False:
+            self.send_response(416)
+            self.send_header("Content-Range", "bytes */%i" % size)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if byte_range is None:
+            start, end = 0, size
+            self.send_response(200)
+        else:
+            start, end = byte_range
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes %i-%i/%i" % (start, end - 1, size))
+        self.send_header("Content-Type", mimetypes.guess_type(path)[0] or "application/octet-stream")
+        self.send_header("Content-Length", str(end - start))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        self.end_headers()
+        if send_body:
+            try:
+                pak_file.copy_member(offset + start, end - start, self.wfile)
+            except socket.error:
+                # the client went away in the middle of the body
+                self.close_connection = 1
+
+class PAK_server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """ HTTP server over a PAK_vfs, every connection gets its own thread. """
+    daemon_threads = True
+    allow_reuse_address = True
+    
+    def __init__(self, vfs, address=("127.0.0.1", 8080), verbose=False):
+        self.vfs = vfs
+        self.verbose = verbose
+        # build the merged index before the first request, so requests never parse a descriptor
+        vfs.get_dirs()
+        BaseHTTPServer.HTTPServer.__init__(self, address, PAK_request_handler)
+
+if __name__ == "__main__":
+    vfs = PAK_vfs.from_install("C:\Program Files (x86)\Steam\steamapps\common\jabia", sidecar=True)
+    PAK_server(vfs).serve_forever()
@@ -0,0 +1,303 @@
+"""
+Created on October 17, 2026
+"""
+"""
+    Copyright (C) 2026 JA-BiA-Tools contributors
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import stat
+import posixpath
+import ctypes
+import shutil
+import hashlib
+import time
+from pak_file import PAK_CHUNK_SIZE, PAK_session, add_time, normalize_path
+from pak_vfs import get_load_position
+
+def make_link(src_filepath, dest_filepath):
+    """ Hard link dest_filepath to src_filepath, returns False where the file system can not do it. """
+    try:
+        if hasattr(os, "link"):
+            os.link(src_filepath, dest_filepath)
+            return True
+        if sys.platform == "win32":
+            # Python 2 has no os.link on Windows
+            return bool(ctypes.windll.kernel32.CreateHardLinkW(unicode(dest_filepath), unicode(src_filepath), None))
+    except (OSError, AttributeError):
+        pass
+    return False
+
+def remove_empty_dirs(dest_filepath, dir):
+    """ Remove dir, a directory relative to dest_filepath, and its parents as long as they are empty. """
+    while dir != "":
+        filepath = os.path.join(dest_filepath, *dir.split("/"))
+        if not os.path.isdir(filepath) or os.listdir(filepath):
+            break
+        os.rmdir(filepath)
+        dir = posixpath.dirname(dir)
+
+class PAK_store_tree:
+    """ Record of the files a store materialised into a directory.
+    
+    Each line holds path, size, digest and the modification time of the file, separated by tabs.
+    Only recorded files are ever removed, and a recorded file is linked again only if one of them changed.
+    """
+    file_name = "pak_store.txt"
+    
+    def __init__(self, dest_filepath):
+        self.dest_filepath = dest_filepath
+        self.filepath = os.path.join(dest_filepath, self.file_name)
+        self.entries = {}   # {path : (size, digest, mtime)} mapping
+        if os.path.exists(self.filepath):
+            self.load()
+    
+    def load(self):
+        with open(self.filepath, "rb") as f:
+            for line in f:
+                path, size, digest, mtime = line.rstrip("\r\n").split("\t")
+                self.entries[path] = (int(size), digest, float(mtime))
+    
+    def save(self):
+        if not os.path.exists(self.dest_filepath):
+            os.makedirs(self.dest_filepath)
+        temp_filepath = self.filepath + ".tmp"
+        with open(temp_filepath, "wb") as f:
+            for path in sorted(self.entries):
+                size, digest, mtime = self.entries[path]
+                f.write("%s\t%i\t%s\t%r\n" % (path, size, digest, mtime))
+        if os.path.exists(self.filepath):
+            os.remove(self.filepath)
+        os.rename(temp_filepath, self.filepath)
+    
+    def is_current(self, path, size, digest):
+        entry = self.entries.get(path)
+        if entry is None or entry[:2] != (size, digest):
+            return False
+        try:
+            file_stat = os.stat(os.path.join(self.dest_filepath, *path.split("/")))
+        except OSError:
+            return False
+        # the file was replaced after it was materialised
+        return file_stat.st_size == size and file_stat.st_mtime == entry[2]
+    
+    def update(self, path, size, digest):
+        mtime = os.stat(os.path.join(self.dest_filepath, *path.split("/"))).st_mtime
+        self.entries[path] = (size, digest, mtime)
+
+class PAK_store:
+    """ Content-addressed store of extracted members, shared by every game version.
+    
+    Each member is stored once under the sha1 of its data in objects/, no matter how many
+    versions or archives contain it. A version is a manifest in versions/ that maps paths to
+    digests, its tree can be materialised anywhere as hard links to the objects.
+    Objects are read-only, so a tool that rewrites a linked file in place fails instead of
+    changing the file in every version.
+    """
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.objects_dir = os.path.join(store_dir, "objects")
+        self.versions_dir = os.path.join(store_dir, "versions")
+        for path in (self.objects_dir, self.versions_dir):
+            if not os.path.exists(path):
+                os.makedirs(path)
+    
+    def get_object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest[2:])
+    
+    def get_version_path(self, version):
+        return os.path.join(self.versions_dir, version + ".txt")
+    
+    def get_versions(self):
+        return sorted(name[:-4] for name in os.listdir(self.versions_dir) if name.endswith(".txt"))
+    
+    def load_version(self, version):
+        """ Return the {path : (size, digest, archive)} mapping of a version, empty if it does not exist. """
+        entries = {}
+        filepath = self.get_version_path(version)
+        if os.path.exists(filepath):
+            with open(filepath, "rb") as f:
+                for line in f:
+                    path, size, digest, archive = line.rstrip("\r\n").split("\t")
+                    entries[path] = (int(size), digest, archive)
+        return entries
+    
+    def save_version(self, version, entries):
+        filepath = self.get_version_path(version)
+        temp_filepath = filepath + ".tmp"
+        with open(temp_filepath, "wb") as f:
+            for path in sorted(entries):
+                size, digest, archive = entries[path]
+                f.write("%s\t%i\t%s\t%s\n" % (path, size, digest, archive))
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        os.rename(temp_filepath, filepath)
+    
+    def hash_member(self, pak_file, offset, size, timings=None):
+        sha1 = hashlib.sha1()
+        start = time.time()
+        for position in xrange(0, size, PAK_CHUNK_SIZE):
+            sha1.update(pak_file.get_view(offset + position, min(PAK_CHUNK_SIZE, size - position)))
+        add_time(timings, "read", start)
+        return sha1.hexdigest()
+    
+    def add_object(self, pak_file, offset, size, digest, timings=None):
+        """ Write member data under its digest, returns False if the object was already stored. """
+        object_path = self.get_object_path(digest)
+        if os.path.exists(object_path):
+            return False
+        dir = os.path.dirname(object_path)
+        if not os.path.exists(dir):
+            os.makedirs(dir)
+        temp_filepath = "%s.%i.tmp" % (object_path, os.getpid())
+        with open(temp_filepath, "wb") as f:
+            pak_file.copy_member(offset, size, f, timings=timings)
+        os.chmod(temp_filepath, stat.S_IREAD)
+        if os.path.exists(object_path):
+            # another process stored it first
+            os.chmod(temp_filepath, stat.S_IREAD | stat.S_IWRITE)
+            os.remove(temp_filepath)
+            return False
+        os.rename(temp_filepath, object_path)
+        return True
+    
+    def add_archive(self, pak_file, version, member_filter=None, session=None, verbose=False):
+        """ Store every member of an archive and record it in the manifest of version.
+        
+        Members are hashed first and only written if their digest is new, so adding a
+        version that mostly repeats an earlier one writes only the changed files.
+        The entries the manifest had for this archive are replaced, so members the archive
+        no longer contains leave the version. A path another archive already holds is only
+        taken over if this archive is loaded after it, whatever order the archives are added in.
+        Returns (number of new objects, bytes written).
+        """
+        if session is None:
+            session = PAK_session()
+        with session.timer("descriptor"):
+            index = pak_file.get_index()
+        members = [(path, offset, size) for path, offset, size, _ in index
+                   if member_filter is None or member_filter.match(path)]
+        archive = os.path.basename(pak_file.filepath)
+        entries = self.load_version(version)
+        for path in [path for path, (_, _, source) in entries.iteritems() if source == archive]:
+            if member_filter is None or member_filter.match(path):
+                del entries[path]
+        decrypt_time = pak_file.get_decrypt_time()
+        session.start(len(members), sum(size for _, _, size in members))
+        new_objects = 0
+        new_bytes = 0
+        try:
+            for path, offset, size in members:
+                timings = {}
+                digest = self.hash_member(pak_file, offset, size, timings)
+                if self.add_object(pak_file, offset, size, digest, timings):
+                    new_objects += 1
+                    new_bytes += size
+                    if verbose:
+                        print "New object %s %s" % (digest, path)
+                if path not in entries or get_load_position(entries[path][2]) <= get_load_position(archive):
+                    entries[path] = (size, digest, archive)
+                session.progress(1, size, timings)
+        finally:
+            # objects without a manifest entry would only be found again by prune
+            self.save_version(version, entries)
+        session.add_time("decrypt", pak_file.get_decrypt_time() - decrypt_time)
+        session.finish()
+        return new_objects, new_bytes
+    
+    def materialize(self, version, dest_filepath, copy=False):
+        """ Build the tree of a version in dest_filepath out of hard links, or copies if copy is True
+        or the file system has no hard links.
+        
+        The files put there are recorded in dest_filepath, see PAK_store_tree. Recorded files that 
+        still match the manifest are kept, recorded files the manifest no longer lists are removed.
+        Files the store did not put there are only replaced if the manifest has their path.
+        """
+        entries = self.load_version(version)
+        tree = PAK_store_tree(dest_filepath)
+        try:
+            for path in sorted(set(tree.entries) - set(entries)):
+                self.remove_link(os.path.join(dest_filepath, *path.split("/")), tree.entries[path][1])
+                del tree.entries[path]
+                remove_empty_dirs(dest_filepath, posixpath.dirname(path))
+            for path in sorted(entries):
+                size, digest, _ = entries[path]
+                if tree.is_current(path, size, digest):
+                    continue
+                filepath = os.path.join(dest_filepath, *path.split("/"))
+                if os.path.exists(filepath):
+                    self.remove_link(filepath, tree.entries[path][1] if path in tree.entries else None)
+                dir = os.path.dirname(filepath)
+                if not os.path.exists(dir):
+                    os.makedirs(dir)
+                object_path = self.get_object_path(digest)
+                if copy or not make_link(object_path, filepath):
+                    shutil.copyfile(object_path, filepath)
+                tree.update(path, size, digest)
+        finally:
+            tree.save()
+    
+    def remove_link(self, filepath, digest=None):
+        """ Remove a materialised file, a read-only file can not be removed on Windows.
+        
+        A hard link shares the read-only attribute with its object, the object is made read-only again.
+        """
+        if not os.path.exists(filepath):
+            return
+        try:
+            os.remove(filepath)
+        except OSError:
+            os.chmod(filepath, stat.S_IREAD | stat.S_IWRITE)
+            os.remove(filepath)
+            if digest is not None and os.path.exists(self.get_object_path(digest)):
+                os.chmod(self.get_object_path(digest), stat.S_IREAD)
+    
+    def open(self, version, path):
+        """ Return a file object over one member of a version, without materialising the tree. """
+        entries = self.load_version(version)
+        key = normalize_path(path)
+        if key not in entries:
+            raise KeyError("%s is not in version %s" % (path, version))
+        return open(self.get_object_path(entries[key][1]), "rb")
+    
+    def prune(self):
+        """ Remove objects no version refers to, returns the number of bytes freed. """
+        referenced = set()
+        for version in self.get_versions():
+            referenced.update(digest for _, digest, _ in self.load_version(version).itervalues())
+        freed = 0
+        for prefix in os.listdir(self.objects_dir):
+            dir = os.path.join(self.objects_dir, prefix)
+            for name in os.listdir(dir):
+                if prefix + name in referenced:
+                    continue
+                filepath = os.path.join(dir, name)
+                freed += os.path.getsize(filepath)
+                os.chmod(filepath, stat.S_IREAD | stat.S_IWRITE)
+                os.remove(filepath)
+        return freed
+
+if __name__ == "__main__":
+    from pak_vfs import PAK_vfs
+    # pak_store.py STORE VERSION JABIA_PATH OUTPUT
+    store_dir, version, jabia_path, dest_filepath = sys.argv[1:5]
+    store = PAK_store(store_dir)
+    vfs = PAK_vfs.from_install(jabia_path)
+    # in load order, so the manifest keeps the copy of each file the game uses
+    for position, filepath in enumerate(vfs.archive_list):
+        print filepath, store.add_archive(vfs.get_archive(position), version)
+    store.materialize(version, dest_filepath)
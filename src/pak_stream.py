@@ -0,0 +1,164 @@
+"""
+Created on October 17, 2026
+"""
+"""
+    Copyright (C) 2026 JA-BiA-Tools contributors
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import struct
+import time
+import zlib
+import tarfile
+import zipfile
+from pak_file import PAK_CHUNK_SIZE, PAK_session
+
+ZIP64_LIMIT = 0xffffffff
+
+class PAK_zip_output:
+    """ Writes a zip file front to back, so the output does not have to support seeking.
+    
+    Sizes and crcs are only known after the data of an entry is written, they follow the data
+    in a data descriptor and are repeated in the central directory at the end.
+    Entries are stored or deflated, the central directory switches to zip64 once it is needed.
+    """
+    def __init__(self, file_pointer, compression=zipfile.ZIP_STORED):
+        self.file_pointer = file_pointer
+        self.compression = compression
+        self.position = 0
+        self.entries = []   # (name, crc, compressed size, size, offset, dos time) of every entry written
+    
+    def write(self, data):
+        self.file_pointer.write(data)
+        self.position += len(data)
+    
+    def add(self, name, size, chunks, mtime=None):
+        """ Add an entry from an iterable of data chunks that add up to size bytes. """
+        if size >= ZIP64_LIMIT:
+            raise Exception("%s is too large for a streamed zip file" % name)
+        date_time = time.localtime(mtime if mtime is not None else time.time())
+        dos_time = (date_time[0] - 1980) << 25 | date_time[1] << 21 | date_time[2] << 16 | \
+            date_time[3] << 11 | date_time[4] << 5 | date_time[5] / 2
+        offset = self.position
+        # bit 3, crc and sizes follow the data
+        self.write(struct.pack("<IHHHIIIIHH", 0x04034b50, 20, 0x08, self.compression, dos_time,
+                               0, 0, 0, len(name), 0))
+        self.write(name)
+        
+        crc = 0
+        compressed_size = 0
+        compressor = None
+        if self.compression == zipfile.ZIP_DEFLATED:
+            compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        for data in chunks:
+            crc = zlib.crc32(data, crc)
+            if compressor is not None:
+                data = compressor.compress(data)
+            compressed_size += len(data)
+            self.write(data)
+        if compressor is not None:
+            data = compressor.flush()
+            compressed_size += len(data)
+            self.write(data)
+        crc &= 0xffffffff
+        if compressed_size >= ZIP64_LIMIT:
+            raise Exception("%s is too large for a streamed zip file" % name)
+        self.write(struct.pack("<IIII", 0x08074b50, crc, compressed_size, size))
+        self.entries.append((name, crc, compressed_size, size, offset, dos_time))
+    
+    def close(self):
+        """ Write the central directory, the output itself is not closed. """
+        directory_offset = self.position
+        for name, crc, compressed_size, size, offset, dos_time in self.entries:
+            extra = ""
+            if offset >= ZIP64_LIMIT:
+                extra = struct.pack("<HHQ", 0x0001, 8, offset)
+                offset = ZIP64_LIMIT
+            version = 45 if extra else 20
+            self.write(struct.pack("<IHHHHIIIIHHHHHII", 0x02014b50, version, version, 0x08, self.compression,
+                                   dos_time, crc, compressed_size, size, len(name), len(extra), 0, 0, 0,
+                                   0100644 << 16, offset))
+            self.write(name)
+            self.write(extra)
+        directory_size = self.position - directory_offset
+        count = len(self.entries)
+        if count >= 0xffff or directory_offset >= ZIP64_LIMIT or directory_size >= ZIP64_LIMIT:
+            zip64_offset = self.position
+            self.write(struct.pack("<IQHHIIQQQQ", 0x06064b50, 44, 45, 45, 0, 0, count, count,
+                                   directory_size, directory_offset))
+            self.write(struct.pack("<IIQI", 0x07064b50, 0, zip64_offset, 1))
+            count = min(count, 0xffff)
+            directory_size = min(directory_size, ZIP64_LIMIT)
+            directory_offset = min(directory_offset, ZIP64_LIMIT)
+        self.write(struct.pack("<IHHHHIIH", 0x06054b50, 0, 0, count, count, directory_size, directory_offset, 0))
+        self.file_pointer.flush()
+
+def get_members(pak_file, member_filter=None):
+    return [(path, offset, size) for path, offset, size, _ in pak_file.get_index()
+            if member_filter is None or member_filter.match(path)]
+
+def read_chunks(pak_file, offset, size, chunk_size=PAK_CHUNK_SIZE):
+    """ Yields the member data chunk by chunk, straight from the map or the decrypted pages. """
+    for position in xrange(0, size, chunk_size):
+        yield pak_file.get_view(offset + position, min(chunk_size, size - position))
+
+def stream_tar(pak_file, file_pointer, member_filter=None, session=None):
+    """ Write the members of an archive as an uncompressed tar stream, file_pointer is only written to. """
+    if session is None:
+        session = PAK_session()
+    members = get_members(pak_file, member_filter)
+    mtime = os.path.getmtime(pak_file.filepath)
+    session.start(len(members), sum(size for _, _, size in members))
+    # tarfile only builds the headers, the data goes straight from the archive to the output
+    written = 0
+    for path, offset, size in members:
+        info = tarfile.TarInfo(path)
+        info.size = size
+        info.mtime = mtime
+        info.mode = 0644
+        header = info.tobuf(tarfile.GNU_FORMAT)
+        file_pointer.write(header)
+        for data in read_chunks(pak_file, offset, size):
+            file_pointer.write(data)
+        padding = -size % tarfile.BLOCKSIZE
+        file_pointer.write("\0" * padding)
+        written += len(header) + size + padding
+        session.progress(1, size)
+    # end of archive marker, padded to a whole record
+    written += 2 * tarfile.BLOCKSIZE
+    file_pointer.write("\0" * (2 * tarfile.BLOCKSIZE + -written % tarfile.RECORDSIZE))
+    file_pointer.flush()
+    session.finish()
+
+def stream_zip(pak_file, file_pointer, member_filter=None, compression=zipfile.ZIP_STORED, session=None):
+    """ Write the members of an archive as a zip stream, file_pointer is only written to. """
+    if session is None:
+        session = PAK_session()
+    members = get_members(pak_file, member_filter)
+    mtime = os.path.getmtime(pak_file.filepath)
+    session.start(len(members), sum(size for _, _, size in members))
+    output = PAK_zip_output(file_pointer, compression)
+    for path, offset, size in members:
+        output.add(path, size, read_chunks(pak_file, offset, size), mtime)
+        session.progress(1, size)
+    output.close()
+    session.finish()
+
+if __name__ == "__main__":
+    import sys
+    from pak_file import PAK_file
+    pF = PAK_file("C:\Program Files (x86)\Jagged Alliance Back in Action Demo\\voices_win32.pak")
+    stream_tar(pF, sys.stdout)
@@ -0,0 +1,166 @@
+"""
+Created on October 17, 2026
+"""
+"""
+    Copyright (C) 2026 JA-BiA-Tools contributors
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import struct
+import zlib
+import hashlib
+import multiprocessing
+from collections import OrderedDict
+from pak_file import PAK_CHUNK_SIZE, PAK_file, PAK_session
+
+def digest_64(digest):
+    return struct.unpack("<Q", digest[:8])[0]
+
+# candidates for the crc field of a member, {name : (new state, update state, value of state)} mapping
+CHECKSUMS = OrderedDict([
+    ("crc32", (lambda: 0, zlib.crc32, lambda value: value & 0xffffffff)),
+    ("crc32_inverted", (lambda: 0, zlib.crc32, lambda value: ~value & 0xffffffff)),
+    ("adler32", (lambda: 1, zlib.adler32, lambda value: value & 0xffffffff)),
+    ("md5_64", (hashlib.md5, lambda data, value: value.update(data) or value, lambda value: digest_64(value.digest()))),
+    ("sha1_64", (hashlib.sha1, lambda data, value: value.update(data) or value, lambda value: digest_64(value.digest()))),
+    ])
+
+def compute_checksums(pak_file, offset, size, names, chunk_size=PAK_CHUNK_SIZE):
+    """ Read a member once and return the {name : value} mapping of the named checksums. """
+    values = dict((name, CHECKSUMS[name][0]()) for name in names)
+    for position in xrange(0, size, chunk_size):
+        data = pak_file.get_view(offset + position, min(chunk_size, size - position))
+        for name in names:
+            values[name] = CHECKSUMS[name][1](data, values[name])
+    return dict((name, CHECKSUMS[name][2](values[name])) for name in names)
+
+def verify_batch(pak_file, algorithm, batch):
+    """ Check a list of (path, offset, size, crc) members, returns (number of bytes, [(path, crc, value)]). """
+    num_bytes = 0
+    failed = []
+    for path, offset, size, crc in batch:
+        value = compute_checksums(pak_file, offset, size, [algorithm])[algorithm]
+        if value != crc:
+            failed.append((path, crc, value))
+        num_bytes += size
+    return num_bytes, failed
+
+verify_worker_pak = None
+
+def init_verify_worker(pak_class, filepath):
+    global verify_worker_pak
+    verify_worker_pak = pak_class(filepath)
+
+def verify_batch_worker(args):
+    batch_id, algorithm, batch = args
+    return batch_id, verify_batch(verify_worker_pak, algorithm, batch)
+
+class PAK_verifier:
+    """ Checks the data of every member against the crc stored in the directory table.
+    
+    It is not documented which checksum the crc field holds, so unless one is given every
+    candidate is computed for a sample of members, in one read per member, and the candidate
+    that matches all of them is used. The whole archive is then read once, in offset order,
+    by a pool of worker processes.
+    """
+    sample_size = 32
+    batch_size = 16 * 1024 * 1024 # in bytes
+    
+    def __init__(self, pak_file, algorithm=None, jobs=1, member_filter=None, session=None):
+        self.pak_file = pak_file
+        self.algorithm = algorithm
+        self.jobs = max(1, jobs)
+        self.member_filter = member_filter
+        self.session = session if session is not None else PAK_session()
+        self.sampled = 0
+        self.matches = {}   # {name : number of sampled members it matched} mapping
+        self.failed = []    # (path, stored crc, computed value) of every member that did not match
+    
+    def get_members(self):
+        with self.session.timer("descriptor"):
+            index = self.pak_file.get_index()
+        return [member for member in index if self.member_filter is None or self.member_filter.match(member[0])]
+    
+    def detect(self, members):
+        """ Return the checksum that matches every sampled member, None if none does. """
+        # empty members match almost anything, the sample is spread over the archive
+        candidates = [member for member in members if member[2] > 0]
+        step = max(1, len(candidates) / self.sample_size)
+        sample = candidates[::step][:self.sample_size]
+        self.matches = dict((name, 0) for name in CHECKSUMS)
+        for path, offset, size, crc in sample:
+            for name, value in compute_checksums(self.pak_file, offset, size, CHECKSUMS.keys()).iteritems():
+                if value == crc:
+                    self.matches[name] += 1
+        self.sampled = len(sample)
+        for name in CHECKSUMS:
+            if self.sampled > 0 and self.matches[name] == self.sampled:
+                return name
+        return None
+    
+    def get_batches(self, members):
+        batches = []
+        batch = []
+        batch_bytes = 0
+        for member in sorted(members, key=lambda member: member[1]):
+            batch.append(member)
+            batch_bytes += member[2]
+            if batch_bytes >= self.batch_size:
+                batches.append(batch)
+                batch = []
+                batch_bytes = 0
+        if len(batch) > 0:
+            batches.append(batch)
+        return batches
+    
+    def run(self):
+        """ Returns the list of members that failed, or None if the checksum could not be found. """
+        members = self.get_members()
+        if self.algorithm is None:
+            self.algorithm = self.detect(members)
+            if self.algorithm is None:
+                return None
+        session = self.session
+        session.start(len(members), sum(member[2] for member in members))
+        batches = self.get_batches(members)
+        pool = None
+        if self.jobs == 1:
+            results = ((batch_id, verify_batch(self.pak_file, self.algorithm, batch))
+                       for batch_id, batch in enumerate(batches))
+        else:
+            # checksums hold the interpreter lock, so the work is spread over processes
+            if self.pak_file.plain_filepath is not None:
+                worker_args = (PAK_file, self.pak_file.plain_filepath)
+            else:
+                worker_args = (self.pak_file.__class__, self.pak_file.filepath)
+            pool = multiprocessing.Pool(self.jobs, init_verify_worker, worker_args)
+            results = pool.imap_unordered(verify_batch_worker,
+                                          [(batch_id, self.algorithm, batch) for batch_id, batch in enumerate(batches)])
+        try:
+            for batch_id, (num_bytes, failed) in results:
+                self.failed.extend(failed)
+                session.progress(len(batches[batch_id]), num_bytes)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        session.finish()
+        return self.failed
+
+if __name__ == "__main__":
+    pF = PAK_file("C:\Program Files (x86)\Jagged Alliance Back in Action Demo\\voices_win32.pak")
+    verifier = PAK_verifier(pF, jobs=4)
+    for path, crc, value in verifier.run() or []:
+        print path
@@ -0,0 +1,152 @@
+"""
+Created on October 17, 2026
+"""
+"""   
+    Copyright (C) 2026 JA-BiA-Tools contributors
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import posixpath
+import threading
+from pak_file import PAK_file, PAK_CRYPT_file, PAK_member, normalize_path
+
+# archives of an install in the order the game loads them, later archives override earlier ones
+JABIA_ARCHIVES = ["data_win32.pak", "data1_win32.pak", "data2_win32.pak", "data3_win32.pak", 
+                  "data4_win32.pak", "data5_win32.pak", "data6_win32.pak", 
+                  "configs_win32.pak.crypt", "interface_win32.pak.crypt",
+                  "dlc5_dlc5_configs_win32.pak.crypt", "dlc6_dlc6_configs_win32.pak.crypt"]
+
+def open_archive(filepath, cache=None):
+    """ Open a pak or pak.crypt file depending on its extension. """
+    if os.path.splitext(filepath)[1][1:].strip() == "crypt":
+        return PAK_CRYPT_file(filepath, cache)
+    return PAK_file(filepath)
+
+def get_load_position(name):
+    """ Sort key of an archive file name in load order, unknown archives last in name order. """
+    if name.lower() in JABIA_ARCHIVES:
+        return (0, JABIA_ARCHIVES.index(name.lower()))
+    return (1, name)
+
+def find_archives(jabia_path):
+    """ Return the file paths of the archives of an install in load order, unknown archives last in name order. """
+    names = sorted((name for name in os.listdir(jabia_path) if name.endswith(".pak") or name.endswith(".pak.crypt")), 
+                   key=get_load_position)
+    return [os.path.join(jabia_path, name) for name in names]
+
+class PAK_vfs:
+    """ Read-only view of a stack of archives as one file system.
+    
+    Archives are only opened once a lookup needs them. The merged index maps every path 
+    to the last archive in the stack that contains it, the same way the game resolves assets.
+    """
+    def __init__(self, archive_list=None, sidecar=None, cache=None):
+        self.archive_list = []      # file paths, lowest priority first
+        self.archives = {}          # {position in archive_list : PAK_file} mapping
+        self.sidecar = sidecar      # directory for index sidecars, or True to keep them next to the archives
+        self.cache = cache
+        self.lookup = None          # {path : position in archive_list} mapping
+        self.dirs = None            # {directory : set of names} mapping
+        self.lock = threading.Lock()
+        for filepath in archive_list or []:
+            self.add_archive(filepath)
+    
+    @classmethod
+    def from_install(cls, jabia_path, sidecar=None, cache=None):
+        """ Stack every archive of an install, unknown archives go on top in name order. """
+        return cls(find_archives(jabia_path), sidecar, cache)
+    
+    def add_archive(self, filepath):
+        """ Put an archive on top of the stack. """
+        with self.lock:
+            self.archive_list.append(os.path.abspath(filepath))
+            self.lookup = None
+            self.dirs = None
+    
+    def get_archive(self, position):
+        with self.lock:
+            if position not in self.archives:
+                self.archives[position] = open_archive(self.archive_list[position], self.cache)
+            return self.archives[position]
+    
+    def get_lookup(self):
+        if self.lookup is None:
+            lookup = {}
+            for position in xrange(len(self.archive_list)):
+                index = self.get_archive(position).get_index(self.sidecar)
+                for path in index.path_list:
+                    lookup[path] = position
+            self.lookup = lookup
+        return self.lookup
+    
+    def get_dirs(self):
+        if self.dirs is None:
+            dirs = {"" : set()}
+            for path in self.get_lookup():
+                dir, name = posixpath.split(path)
+                while True:
+                    if dir in dirs:
+                        dirs[dir].add(name)
+                        break
+                    dirs[dir] = set([name])
+                    dir, name = posixpath.split(dir)
+            self.dirs = dirs
+        return self.dirs
+    
+    def find(self, path):
+        """ Return (PAK_file, offset, size, crc) of the copy of path the game would load. """
+        key = normalize_path(path)
+        position = self.get_lookup().get(key)
+        if position is None:
+            raise KeyError("%s is not in any archive" % path)
+        pak_file = self.get_archive(position)
+        offset, size, crc = pak_file.get_index().find(key)
+        return pak_file, offset, size, crc
+    
+    def which(self, path):
+        """ Return the file path of the archive path is loaded from. """
+        return self.find(path)[0].filepath
+    
+    def exists(self, path):
+        key = normalize_path(path)
+        return key in self.get_lookup() or key.rstrip("/") in self.get_dirs()
+    
+    def isdir(self, path):
+        return normalize_path(path).rstrip("/") in self.get_dirs()
+    
+    def listdir(self, path=""):
+        dir = normalize_path(path).rstrip("/")
+        if dir not in self.get_dirs():
+            raise OSError("%s is not a directory in any archive" % path)
+        return sorted(self.get_dirs()[dir])
+    
+    def read(self, path):
+        pak_file, offset, size, _ = self.find(path)
+        return pak_file.get_view(offset, size)
+    
+    def open(self, path):
+        return PAK_member(normalize_path(path), self.read(path))
+    
+    def close(self):
+        with self.lock:
+            for pak_file in self.archives.values():
+                pak_file.close()
+            self.archives = {}
+
+if __name__ == "__main__":
+    vfs = PAK_vfs.from_install("C:\Program Files (x86)\Steam\steamapps\common\jabia", sidecar=True)
+    print vfs.listdir("bin_win32/interface")
+    print vfs.which("bin_win32/interface/equipment.ctx")
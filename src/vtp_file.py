@@ -21,6 +21,7 @@ Created on February 6, 2012
 """
 
 import struct          
+from cStringIO import StringIO
 from jabia_file import JABIA_file
 
 class VTP_constant:
@@ -69,22 +70,25 @@ class VTP_item:
         self.unknown2 = None
         self.constant_list = []
         
-    def get_packed_data(self, section): 
-        data_buffer = struct.pack("<IHI%is" % len(self.id_name), 
-                                  self.id, self.unknown_const, len(self.id_name), self.id_name)
-        data_buffer += struct.pack("<B", len(self.variable_list))
+    def write_to(self, stream, section): 
+        stream.write(struct.pack("<IHI%is" % len(self.id_name), 
+                                 self.id, self.unknown_const, len(self.id_name), self.id_name))
+        stream.write(struct.pack("<B", len(self.variable_list)))
         for variable in self.variable_list:
-            data_buffer += variable.get_packed_data()
+            stream.write(variable.get_packed_data())
         if section == 0 or section == 4:
-            data_buffer += "\x00\x00"
+            stream.write("\x00\x00")
         if section == 1 or section == 2:
-            data_buffer += "\x00"
+            stream.write("\x00")
         if section == 3:
-            data_buffer += struct.pack("<BBB", self.unknown1, len(self.constant_list), self.unknown2)
+            stream.write(struct.pack("<BBB", self.unknown1, len(self.constant_list), self.unknown2))
         for constant in self.constant_list:
-            data_buffer += constant.get_packed_data()
-        #print binascii.hexlify(data_buffer)
-        return data_buffer
+            stream.write(constant.get_packed_data())
+    
+    def get_packed_data(self, section): 
+        stream = StringIO()
+        self.write_to(stream, section)
+        return stream.getvalue()
     
 #    def __repr__(self):
 #        return "%s(name=%r, id=%r, id_name=%r, path=%r)" % (
@@ -188,42 +192,24 @@ class VTP_data:
         if peek:
             return  
                     
-    def get_packed_data(self):
+    def write_to(self, stream):
         # header, 1 and number of sections
-        data_buffer = "\x01\x05"
-        
-        # first section, 3d objects
-        data_buffer += "\x00"
-        data_buffer += struct.pack("<H", len(self.object_3d_list1))
-        for object in self.object_3d_list1:
-            data_buffer += object.get_packed_data(0)            
+        stream.write("\x01\x05")
         
-        # second section, animations
-        data_buffer += "\x01"
-        data_buffer += struct.pack("<H", len(self.animation_list))
-        for object in self.animation_list:
-            data_buffer += object.get_packed_data(1)
+        sections = [self.object_3d_list1,   # first section, 3d objects
+                    self.animation_list,    # second section, animations
+                    self.effects_list,      # third section, effects
+                    self.materials_list,    # fourth section, materials
+                    self.object_3d_list2]   # fifth section, second set of 3d objects
+        for section, object_list in enumerate(sections):
+            stream.write(struct.pack("<BH", section, len(object_list)))
+            for object in object_list:
+                object.write_to(stream, section)
     
-        # third section, effects
-        data_buffer += "\x02"
-        data_buffer += struct.pack("<H", len(self.effects_list))
-        for object in self.effects_list:
-            data_buffer += object.get_packed_data(2)
-            
-        # fourth section, materials
-        data_buffer += "\x03"
-        data_buffer += struct.pack("<H", len(self.materials_list))
-        for object in self.materials_list:
-            data_buffer += object.get_packed_data(3)
-        
-        # fifth section, second set of 3d objects
-        data_buffer += "\x04"
-        data_buffer += struct.pack("<H", len(self.object_3d_list2))
-        for object in self.object_3d_list2:
-            data_buffer += object.get_packed_data(4)    
-                                
-        # return     
-        return data_buffer            
+    def get_packed_data(self):
+        stream = StringIO()
+        self.write_to(stream)
+        return stream.getvalue()
 
     def __repr__(self):
         return "%s(name=%r, languages=%r)" % (